@@ -5,12 +5,15 @@ from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from openai import OpenAI
 from pydantic import BaseModel
+from typing import Optional
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 
 from simulatrex.dsl_parser import (
     parse_dsl,
 )
+from simulatrex.llms.utils.scheduler import Lane, current_lane
+from simulatrex.llms.utils.usage import Budget
 
 app = FastAPI()
 
@@ -26,9 +29,12 @@ app.add_middleware(
 
 class SimulationRequest(BaseModel):
     code: str
+    # Optional soft_tokens, hard_tokens, soft_cost, hard_cost, throttle_delay
+    budget: Optional[dict] = None
 
 
 simulation_task: asyncio.Task = None
+current_simulation = None
 progress = 0
 simulation_logs = []
 
@@ -51,6 +57,7 @@ logger.addHandler(StreamLogHandler())
 @app.post("/api/v1/simulation")
 async def run_simulation(request: SimulationRequest):
     global simulation_task
+    global current_simulation
 
     if simulation_task and not simulation_task.done():
         raise HTTPException(status_code=400, detail="Simulation is already running")
@@ -60,10 +67,13 @@ async def run_simulation(request: SimulationRequest):
 
     try:
         simulation = parse_dsl(request.code)
+        if request.budget:
+            simulation.usage.budget = Budget(**request.budget)
         agents = [agent.to_dict() for agent in simulation.agents]
         environment = simulation.environment.to_dict()
         simulation_details = simulation.to_dict()
         if simulation:
+            current_simulation = simulation
             simulation_task = asyncio.create_task(simulation.run())
             return {
                 "status": "Simulation started successfully.",
@@ -94,6 +104,43 @@ def stream_simulation_progress(request: Request):
     return response
 
 
+@app.get("/api/v1/simulation/agents/{agent_id}/stream")
+async def stream_agent_action(agent_id: str, action: str):
+    if current_simulation is None:
+        raise HTTPException(status_code=404, detail="No simulation loaded.")
+
+    agent = next(
+        (a for a in current_simulation.agents if a.identifier == agent_id), None
+    )
+    if agent is None:
+        raise HTTPException(status_code=404, detail=f"Agent {agent_id} not found.")
+
+    async def generate():
+        # Scoped to this response, keeps the UI ahead of running simulations
+        current_lane.set(Lane.INTERACTIVE)
+        chunks = []
+        try:
+            async for chunk in agent.stream_action(action):
+                chunks.append(chunk)
+                yield f"data: {json.dumps({'token': chunk})}\n\n"
+        except Exception as e:
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            return
+        yield f"data: {json.dumps({'done': True, 'response': ''.join(chunks)})}\n\n"
+
+    response = StreamingResponse(generate(), media_type="text/event-stream")
+    response.headers["Access-Control-Allow-Origin"] = "*"  # For testing purposes
+    return response
+
+
+@app.get("/api/v1/simulation/usage")
+async def get_simulation_usage():
+    if current_simulation is None:
+        raise HTTPException(status_code=404, detail="No simulation loaded.")
+
+    return current_simulation.usage.to_dict()
+
+
 @app.post("/api/v1/simulation/cancel")
 async def cancel_simulation():
     global simulation_task
@@ -29,6 +29,7 @@ setup(
         "instructor",
         "SQLAlchemy",
         "nest_asyncio",
+        "aiohttp",
         "ply",
     ],
 )
@@ -23,6 +23,141 @@ SETTINGS = {
         "allowed": None,
         "user_message": "What is the maximum number of seconds to wait for an API call to return?",
     },
+    "LLM_MAX_CONNECTIONS": {
+        "default": "100",
+        "allowed": None,
+        "user_message": "What is the maximum number of open connections per shared LLM client?",
+    },
+    "LLM_MAX_KEEPALIVE_CONNECTIONS": {
+        "default": "20",
+        "allowed": None,
+        "user_message": "How many idle keep-alive connections should each shared LLM client retain?",
+    },
+    "LLM_CACHE_ENABLED": {
+        "default": "false",
+        "allowed": ["true", "false"],
+        "user_message": "Should LLM responses be cached in memory and on disk?",
+    },
+    "LLM_CACHE_DETERMINISTIC_ONLY": {
+        "default": "true",
+        "allowed": ["true", "false"],
+        "user_message": "Should only temperature 0 LLM calls be cached?",
+    },
+    "LLM_MAX_RETRIES": {
+        "default": "3",
+        "allowed": None,
+        "user_message": "How often should a failed LLM call be retried?",
+    },
+    "LLM_MAX_CONCURRENT_REQUESTS": {
+        "default": "64",
+        "allowed": None,
+        "user_message": "How many LLM requests may be in flight at once across all priority lanes?",
+    },
+    "LLM_SCHEDULER_MAX_WAIT_SEC": {
+        "default": "30",
+        "allowed": None,
+        "user_message": "After how many seconds should a queued LLM request be served regardless of its lane?",
+    },
+    "LLM_RATE_LIMIT_RPM": {
+        "default": None,
+        "allowed": None,
+        "user_message": "How many requests per minute may each model send? Leave empty for the low tier defaults, 0 for no limit.",
+    },
+    "LLM_RATE_LIMIT_TPM": {
+        "default": None,
+        "allowed": None,
+        "user_message": "How many tokens per minute may each model use? Leave empty for the low tier defaults, 0 for no limit.",
+    },
+    "LLM_EXECUTION_MODE": {
+        "default": "realtime",
+        "allowed": ["realtime", "batch"],
+        "user_message": "Should OpenAI calls be sent right away or collected into batch jobs?",
+    },
+    "LLM_BATCH_BACKEND": {
+        "default": "openai",
+        "allowed": ["openai", "local"],
+        "user_message": "Should batch jobs go to the OpenAI Batch API or to the local file stand-in?",
+    },
+    "VECTOR_DB_BACKEND": {
+        "default": "chroma",
+        "allowed": ["chroma", "memory"],
+        "user_message": "Should agent memories live in persistent ChromaDB collections or in an in-process NumPy index?",
+    },
+    "VECTOR_DB_ROOT": {
+        "default": None,
+        "allowed": None,
+        "user_message": "Where should persistent vector collections be stored? Defaults to ./chromadb.",
+    },
+    "VECTOR_DB_SHARDS": {
+        "default": "1",
+        "allowed": None,
+        "user_message": "Into how many collections should the memories of one simulation be sharded?",
+    },
+    "VECTOR_DB_SNAPSHOT_DIR": {
+        "default": None,
+        "allowed": None,
+        "user_message": "Where should in-process vector indexes be snapshotted? Leave empty to keep them in memory only.",
+    },
+    "LTM_DB_SHARDS": {
+        "default": "1",
+        "allowed": None,
+        "user_message": "Into how many SQLite databases should the long-term memories of all agents be sharded?",
+    },
+    "SQLITE_POOL_SIZE": {
+        "default": "5",
+        "allowed": None,
+        "user_message": "How many connections should each SQLite database keep pooled?",
+    },
+    "MEMORY_IO_WORKERS": {
+        "default": "8",
+        "allowed": None,
+        "user_message": "How many threads should run the async memory store calls?",
+    },
+    "EMBEDDING_BACKEND": {
+        "default": "openai",
+        "allowed": ["openai", "hashing", "local"],
+        "user_message": "Which backend should embed memories: the OpenAI API, the offline hashing embedder or a local model?",
+    },
+    "EMBEDDING_MODEL": {
+        "default": None,
+        "allowed": None,
+        "user_message": "Which embedding model (or local model path) should be used? Leave empty for the backend default.",
+    },
+    "EMBEDDING_DIMENSIONS": {
+        "default": "512",
+        "allowed": None,
+        "user_message": "How many dimensions should the hashing embedder produce?",
+    },
+    "EMBEDDING_CACHE_ENABLED": {
+        "default": "true",
+        "allowed": ["true", "false"],
+        "user_message": "Should embeddings be cached in memory and on disk by content hash?",
+    },
+    "LLM_BACKEND": {
+        "default": "api",
+        "allowed": ["api", "mock"],
+        "user_message": "Should LLM calls go to the provider APIs or to the offline mock backend?",
+    },
+    "MOCK_LLM_SEED": {
+        "default": "0",
+        "allowed": None,
+        "user_message": "Which seed should the mock LLM backend use?",
+    },
+    "MOCK_LLM_LATENCY_MS": {
+        "default": "0",
+        "allowed": None,
+        "user_message": "What mean latency in milliseconds should the mock LLM backend simulate?",
+    },
+    "MOCK_LLM_LATENCY_DISTRIBUTION": {
+        "default": "constant",
+        "allowed": ["constant", "uniform", "normal", "lognormal", "exponential"],
+        "user_message": "How should the mock LLM backend latency be distributed?",
+    },
+    "MOCK_LLM_ERROR_RATE": {
+        "default": "0",
+        "allowed": None,
+        "user_message": "Which fraction of mock LLM calls should fail?",
+    },
 }
 
 
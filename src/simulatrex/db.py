@@ -5,12 +5,28 @@ File: db.py
 Description: Database utils
 
 """
+import atexit
+import hashlib
 import os
+import threading
 import uuid
-from sqlalchemy import Column, String, Float, Integer, create_engine
+from sqlalchemy import (
+    Column,
+    String,
+    Float,
+    Integer,
+    Index,
+    create_engine,
+    event,
+    inspect,
+)
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import sessionmaker, declarative_base
 
+from simulatrex.config import global_config
+from simulatrex.utils.errors import DatabaseSchemaError
 from simulatrex.utils.log import SingletonLogger
+from simulatrex.utils.sync import get_background_flusher, run_in_memory_executor
 
 Base = declarative_base()
 
@@ -19,8 +35,20 @@ _logger = SingletonLogger
 
 class MemoryUnitDB(Base):
     __tablename__ = "memory_units"
+    __table_args__ = (
+        # Serves query_memory_by_type: equality on the owner and type, newest first
+        Index(
+            "ix_memory_units_owner_type_created",
+            "simulation_id",
+            "agent_id",
+            "type",
+            "created",
+        ),
+    )
 
-    id = Column(String, primary_key=True, default=str(uuid.uuid4()))
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    simulation_id = Column(String, default="")
+    agent_id = Column(String, default="")
     type = Column(String)
     depth = Column(Float)
     content = Column(String)
@@ -30,29 +58,314 @@ class MemoryUnitDB(Base):
     score = Column(Float, default=0.0)
 
 
-class SqliteDB:
-    def __init__(self, db_name):
+def sqlite_db_root() -> str:
+    return os.path.join(os.getcwd(), "sqlite_db")
+
+
+# Applied to every new connection. WAL lets readers run next to the writer
+# and, with synchronous=NORMAL, syncs at checkpoints instead of per commit.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -64000,
+    "mmap_size": 268435456,
+    "busy_timeout": 5000,
+}
+
+
+def _apply_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(db_path: str):
+    """
+    Returns the engine shared by every SqliteDB on db_path. Its connection
+    pool is shared as well, so opening a db again costs no new connections.
+    """
+    with _engines_lock:
+        engine = _engines.get(db_path)
+        if engine is None:
+            if not os.path.exists(os.path.dirname(db_path)):
+                os.makedirs(os.path.dirname(db_path))
+
+            engine = create_engine(
+                f"sqlite:///{db_path}",
+                pool_size=int(global_config.get("SQLITE_POOL_SIZE")),
+                max_overflow=0,
+                # Pooled connections are handed to whichever thread asks
+                connect_args={"check_same_thread": False},
+            )
+            event.listen(engine, "connect", _apply_pragmas)
+            Base.metadata.create_all(engine)
+            _check_schema(engine, db_path)
+            _engines[db_path] = engine
+    return engine
+
+
+def _check_schema(engine, db_path: str):
+    """create_all skips existing tables, so files of an older layout stay."""
+    columns = inspect(engine).get_columns(MemoryUnitDB.__tablename__)
+    existing = {column["name"] for column in columns}
+    missing = set(MemoryUnitDB.__table__.columns.keys()) - existing
+    if missing:
+        engine.dispose()
+        raise DatabaseSchemaError(
+            f"{db_path} has no columns {sorted(missing)}, it was written by an "
+            "older version. Move it away to start a new database."
+        )
+
+
+def close_engine(db_path: str):
+    with _engines_lock:
+        engine = _engines.pop(db_path, None)
+    if engine is not None:
+        engine.dispose()
+
+
+def memory_row(memory: MemoryUnitDB) -> dict:
+    """Column values of a memory, for bulk inserts."""
+    row = {
+        column.name: getattr(memory, column.name)
+        for column in MemoryUnitDB.__table__.columns
+        if getattr(memory, column.name) is not None
+    }
+    row.setdefault("id", str(uuid.uuid4()))
+    return row
+
+
+class AsyncMemoryDBMixin:
+    """Async counterparts of the memory db calls, run on the memory executor."""
+
+    async def aquery_memory_by_type(self, type: str, n_results: int, **kwargs):
+        return await run_in_memory_executor(
+            self.query_memory_by_type, type, n_results, **kwargs
+        )
+
+    async def ainsert_memory(self, memory: MemoryUnitDB):
+        await run_in_memory_executor(self.insert_memory, memory)
+
+    async def ainsert_memories(self, memories: list):
+        await run_in_memory_executor(self.insert_memories, memories)
+
+    async def aflush(self):
+        await run_in_memory_executor(self.flush)
+
+
+class SqliteDB(AsyncMemoryDBMixin):
+    """
+    Memory table in a SQLite file. Inserts are buffered and written behind
+    in one transaction, once flush_size memories are pending, before every
+    read, on flush() or from the background flusher flush_interval seconds
+    after the oldest pending one was added.
+    """
+
+    def __init__(self, db_name, flush_size: int = 1000, flush_interval: float = 1.0):
         self.db_name = db_name
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        self.db_path = os.path.join(sqlite_db_root(), f"{self.db_name}.db")
+        self.engine = get_engine(self.db_path)
+        # Loaded memories stay readable after their session is closed
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        # Buffered memories must not be lost when the process ends
+        atexit.register(self.flush)
+
+    def query_memory_by_type(
+        self,
+        type: MemoryUnitDB.type,
+        n_results: int,
+        simulation_id: str = "",
+        agent_id: str = "",
+    ):
+        # Pending writes must be visible to the query
+        self.flush()
+        with self.Session() as session:
+            return (
+                session.query(MemoryUnitDB)
+                .filter(
+                    MemoryUnitDB.simulation_id == simulation_id,
+                    MemoryUnitDB.agent_id == agent_id,
+                    MemoryUnitDB.type == type,
+                )
+                .order_by(MemoryUnitDB.created.desc())
+                .limit(n_results)
+                .all()
+            )
+
+    def insert_memory(self, memory: MemoryUnitDB):
+        self.insert_memories([memory])
+
+    def insert_memories(self, memories: list):
+        if not memories:
+            return
+
+        with self._lock:
+            if not self._buffer:
+                # Written even if no further memory arrives
+                get_background_flusher().schedule(self.flush, self.flush_interval)
+            self._buffer.extend(memory_row(memory) for memory in memories)
+            due = len(self._buffer) >= self.flush_size
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes all buffered memories with one bulk upsert. A memory whose id
+        is already stored replaces the stored row. If the write fails, the
+        rows go back to the buffer and are retried by the next flush.
+        """
+        # Held while writing, so a read after flush() sees every row
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            if not rows:
+                return
+
+            _logger.debug(f"Flushing {len(rows)} memories to {self.db_name}")
+            statement = insert(MemoryUnitDB)
+            statement = statement.on_conflict_do_update(
+                index_elements=[MemoryUnitDB.id],
+                set_={
+                    column.name: statement.excluded[column.name]
+                    for column in MemoryUnitDB.__table__.columns
+                    if not column.primary_key
+                },
+            )
+            try:
+                with self.Session.begin() as session:
+                    session.execute(statement, rows)
+            except Exception:
+                self._buffer[:0] = rows
+                get_background_flusher().schedule(self.flush, self.flush_interval)
+                raise
+
+    def close(self):
+        """Flushes and releases the connections of this database file."""
+        self.flush()
+        atexit.unregister(self.flush)
+        close_engine(self.db_path)
+
+    def delete_memories(self, simulation_id: str, agent_id: str = None):
+        """Deletes the memories of a simulation, or of one of its agents."""
+        self.flush()
+        with self.Session.begin() as session:
+            query = session.query(MemoryUnitDB).filter(
+                MemoryUnitDB.simulation_id == simulation_id
+            )
+            if agent_id is not None:
+                query = query.filter(MemoryUnitDB.agent_id == agent_id)
+            return query.delete(synchronize_session=False)
 
-        self.db_path = os.path.join(os.getcwd(), "sqlite_db", f"{self.db_name}.db")
-        if not os.path.exists(os.path.dirname(self.db_path)):
-            os.makedirs(os.path.dirname(self.db_path))
 
-        self.engine = create_engine(f"sqlite:///{self.db_path}")
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+class AgentMemoryDB(AsyncMemoryDBMixin):
+    """One agent's view on a shared SqliteDB, with the SqliteDB interface."""
 
-        Base.metadata.create_all(self.engine)
+    def __init__(self, db: SqliteDB, simulation_id: str, agent_id: str):
+        self.db = db
+        self.simulation_id = simulation_id
+        self.agent_id = agent_id
 
-    def query_memory_by_type(self, type: MemoryUnitDB.type, n_results: int):
-        return (
-            self.session.query(MemoryUnitDB)
-            .filter(MemoryUnitDB.type == type)
-            .order_by(MemoryUnitDB.created.desc())
-            .limit(n_results)
-            .all()
+    def query_memory_by_type(self, type: str, n_results: int):
+        return self.db.query_memory_by_type(
+            type, n_results, simulation_id=self.simulation_id, agent_id=self.agent_id
         )
 
     def insert_memory(self, memory: MemoryUnitDB):
-        self.session.add(memory)
-        self.session.commit()
+        self.insert_memories([memory])
+
+    def insert_memories(self, memories: list):
+        for memory in memories:
+            memory.simulation_id = self.simulation_id
+            memory.agent_id = self.agent_id
+        self.db.insert_memories(memories)
+
+    def flush(self):
+        self.db.flush()
+
+    def drop(self):
+        """Deletes all memories of this agent."""
+        self.db.delete_memories(self.simulation_id, self.agent_id)
+
+
+class LongTermMemoryStore:
+    """
+    Holds the long-term memories of all agents in one database, or in
+    LTM_DB_SHARDS databases with agents assigned by hash of their
+    (simulation, agent) key. Rows carry simulation_id and agent_id. The
+    shards are sqlite_db/ltm/shard_<n>.db.
+    """
+
+    def __init__(self, shards: int = None):
+        self.shards = (
+            shards if shards is not None else int(global_config.get("LTM_DB_SHARDS"))
+        )
+        self._dbs = {}
+        self._lock = threading.Lock()
+
+    def _db_name(self, shard: int) -> str:
+        # Own directory, the ltm_<agent id>.db files of the former per agent
+        # databases lack the owner columns and must not be opened as a shard
+        return os.path.join("ltm", f"shard_{shard}")
+
+    def _shard(self, simulation_id: str, agent_id: str) -> int:
+        key = f"{simulation_id}/{agent_id}".encode("utf-8")
+        digest = hashlib.sha256(key).digest()
+        return int.from_bytes(digest[:4], "little") % self.shards
+
+    def _db(self, shard: int) -> SqliteDB:
+        with self._lock:
+            if shard not in self._dbs:
+                self._dbs[shard] = SqliteDB(self._db_name(shard))
+        return self._dbs[shard]
+
+    def for_agent(self, simulation_id: str, agent_id: str) -> AgentMemoryDB:
+        """Returns the long-term memory db of one agent."""
+        db = self._db(self._shard(simulation_id, agent_id))
+        return AgentMemoryDB(db, simulation_id, agent_id)
+
+    def flush(self):
+        with self._lock:
+            dbs = list(self._dbs.values())
+        for db in dbs:
+            db.flush()
+
+    def close(self):
+        with self._lock:
+            dbs, self._dbs = list(self._dbs.values()), {}
+        for db in dbs:
+            db.close()
+
+    def drop_simulation(self, simulation_id: str):
+        """Deletes the long-term memories of every agent of a simulation."""
+        deleted = sum(
+            self._db(shard).delete_memories(simulation_id)
+            for shard in range(self.shards)
+        )
+        _logger.info(
+            f"Dropped {deleted} long-term memories of simulation {simulation_id}"
+        )
+
+
+_long_term_store = None
+_long_term_store_lock = threading.Lock()
+
+
+def get_long_term_store() -> LongTermMemoryStore:
+    """Returns the long-term memory store shared by all agents."""
+    global _long_term_store
+
+    with _long_term_store_lock:
+        if _long_term_store is None:
+            _long_term_store = LongTermMemoryStore()
+    return _long_term_store
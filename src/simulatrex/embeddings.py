@@ -0,0 +1,315 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: embeddings.py
+Description: Embedding functions for the vector db
+
+"""
+
+import base64
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import List, Optional
+
+import numpy as np
+from chromadb import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils import embedding_functions
+
+from simulatrex.config import global_config
+from simulatrex.llms.utils.cache import MemoryCache, SqliteCache
+from simulatrex.utils.log import SingletonLogger
+
+_logger = SingletonLogger
+
+
+class Embedder(EmbeddingFunction):
+    """
+    Base class of the vector db embedding backends. embedder_id names the
+    backend, model and dimensions, vectors of different ids never mix.
+    """
+
+    backend = None
+    # Most texts the backend accepts in one call
+    max_batch_size = 2048
+    # Worth caching, i.e. slower than a cache lookup
+    cacheable = True
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    @property
+    def embedder_id(self) -> str:
+        return f"{self.backend}:{self.model_name}"
+
+    def name(self) -> str:
+        return f"simulatrex_{self.backend}"
+
+    def get_config(self) -> dict:
+        return {"model_name": self.model_name}
+
+
+class OpenAIEmbedder(Embedder):
+    backend = "openai"
+
+    def __init__(self, model_name: str = "text-embedding-ada-002"):
+        super().__init__(model_name)
+        api_key = os.getenv("OPENAI_API_KEY")
+
+        if api_key is None:
+            raise Exception(
+                "No OpenAI API key found. Please set OPENAI_API_KEY as environment variable."
+            )
+
+        self._embedding_function = embedding_functions.OpenAIEmbeddingFunction(
+            api_key=api_key, model_name=model_name
+        )
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return self._embedding_function(input)
+
+
+class HashingEmbedder(Embedder):
+    """
+    Offline embedder using the hashing trick: words and word bigrams are
+    hashed into a fixed number of signed buckets, weighted by sublinear
+    term frequency and L2 normalized. Needs no vocabulary or model, so new
+    memories embed instantly, but only captures lexical similarity.
+    """
+
+    backend = "hashing"
+    max_batch_size = 100_000
+    cacheable = False
+
+    def __init__(self, dimensions: int = 512):
+        super().__init__("signed-hashing")
+        self.dimensions = dimensions
+
+    @property
+    def embedder_id(self) -> str:
+        return f"{self.backend}:{self.model_name}:{self.dimensions}"
+
+    def get_config(self) -> dict:
+        return {"dimensions": self.dimensions}
+
+    @staticmethod
+    def features(text: str) -> Counter:
+        words = re.findall(r"\w+", text.lower())
+        return Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature, count in self.features(text).items():
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            sign = 1.0 if value >> 63 else -1.0
+            vector[value % self.dimensions] += sign * (1.0 + math.log(count))
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return [self.embed(text) for text in input]
+
+
+class LocalModelEmbedder(Embedder):
+    """
+    Runs a sentence-transformers model on this machine. model_name is a
+    model name or the path of a downloaded model, for air-gapped runs.
+    """
+
+    backend = "local"
+    max_batch_size = 256
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        super().__init__(model_name)
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError(
+                "The local embedder requires sentence-transformers. "
+                "Install it with `pip install sentence-transformers`."
+            )
+
+        self._model = SentenceTransformer(model_name)
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return list(
+            self._model.encode(
+                list(input), batch_size=self.max_batch_size, normalize_embeddings=True
+            )
+        )
+
+
+EMBEDDERS = {
+    "openai": OpenAIEmbedder,
+    "hashing": HashingEmbedder,
+    "local": LocalModelEmbedder,
+}
+
+
+def create_embedder(backend: str = None, model_name: str = None) -> Embedder:
+    """Returns the embedder selected by EMBEDDING_BACKEND and EMBEDDING_MODEL."""
+    backend = backend or global_config.get("EMBEDDING_BACKEND")
+    model_name = model_name or global_config.get("EMBEDDING_MODEL")
+
+    if backend not in EMBEDDERS:
+        raise ValueError(f"Unknown embedding backend {backend}")
+    if backend == "hashing":
+        return HashingEmbedder(int(global_config.get("EMBEDDING_DIMENSIONS")))
+    if model_name:
+        return EMBEDDERS[backend](model_name)
+    return EMBEDDERS[backend]()
+
+
+def encode_embedding(embedding) -> str:
+    return base64.b64encode(np.asarray(embedding, dtype=np.float32).tobytes()).decode()
+
+
+def decode_embedding(value: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(value), dtype=np.float32)
+
+
+class EmbeddingCache:
+    """
+    Embeddings keyed by (embedding model, sha256 of the text), in a memory
+    LRU in front of an optional persistent SQLite store.
+    """
+
+    def __init__(
+        self,
+        memory_cache: Optional[MemoryCache] = None,
+        store: Optional[SqliteCache] = None,
+    ):
+        self.memory_cache = (
+            memory_cache if memory_cache is not None else MemoryCache(10_000)
+        )
+        self.store = store
+
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model_name}:{digest}"
+
+    def get_many(self, keys: List[str]) -> dict:
+        found = {}
+        missing = []
+        for key in keys:
+            embedding = self.memory_cache.get(key)
+            if embedding is None:
+                missing.append(key)
+            else:
+                found[key] = embedding
+
+        if missing and self.store is not None:
+            for key, value in self.store.get_many(missing).items():
+                embedding = decode_embedding(value)
+                self.memory_cache.set(key, embedding)
+                found[key] = embedding
+
+        with self._stats_lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, embeddings: dict):
+        for key, embedding in embeddings.items():
+            self.memory_cache.set(key, np.asarray(embedding, dtype=np.float32))
+        if self.store is not None:
+            self.store.set_many(
+                {key: encode_embedding(e) for key, e in embeddings.items()}
+            )
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory_cache),
+        }
+
+
+class CachingEmbeddingFunction(EmbeddingFunction):
+    """
+    Wraps an embedding function so that every distinct text is embedded
+    once. A call looks all texts up in the cache and only sends the misses,
+    deduplicated, to the wrapped function in a single batch.
+    """
+
+    def __init__(
+        self,
+        embedding_function: EmbeddingFunction,
+        model_name: str,
+        cache: Optional[EmbeddingCache] = None,
+    ):
+        self.embedding_function = embedding_function
+        self.model_name = model_name
+        self.cache = cache if cache is not None else get_default_embedding_cache()
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [EmbeddingCache.make_key(self.model_name, text) for text in input]
+        found = self.cache.get_many(keys)
+
+        misses = {}
+        for key, text in zip(keys, input):
+            if key not in found:
+                misses.setdefault(key, text)
+
+        if misses:
+            _logger.debug(
+                f"Embedding {len(misses)} of {len(input)} texts, rest from cache"
+            )
+            computed = dict(zip(misses, self.embedding_function(list(misses.values()))))
+            self.cache.set_many(computed)
+            found.update(computed)
+
+        return [np.asarray(found[key], dtype=np.float32) for key in keys]
+
+    # Chroma persists the configuration of the wrapped function
+    def name(self) -> str:
+        return self.embedding_function.name()
+
+    def get_config(self) -> dict:
+        return self.embedding_function.get_config()
+
+    def default_space(self):
+        return self.embedding_function.default_space()
+
+    def supported_spaces(self):
+        return self.embedding_function.supported_spaces()
+
+
+def embedding_function_for(embedder: Embedder) -> EmbeddingFunction:
+    """Returns the embedder, behind the embedding cache if worth it and enabled."""
+    if embedder.cacheable and global_config.get("EMBEDDING_CACHE_ENABLED") == "true":
+        # Texts seen by many agents are embedded only once
+        return CachingEmbeddingFunction(embedder, embedder.embedder_id)
+    return embedder
+
+
+_default_embedding_cache = None
+_default_embedding_cache_lock = threading.Lock()
+
+
+def get_default_embedding_cache() -> EmbeddingCache:
+    """Returns the embedding cache shared by all vector dbs."""
+    global _default_embedding_cache
+
+    with _default_embedding_cache_lock:
+        if _default_embedding_cache is None:
+            _default_embedding_cache = EmbeddingCache(
+                store=SqliteCache(
+                    os.path.join(os.getcwd(), "sqlite_db", "embedding_cache.db"),
+                    max_entries=None,
+                )
+            )
+            _logger.debug("Initialized embedding cache")
+    return _default_embedding_cache
@@ -0,0 +1,243 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: packing.py
+Description: Packs many (agent, question) pairs into a single LLM request
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from pydantic import BaseModel, Field, create_model
+
+from simulatrex.agents.agent import Agent
+from simulatrex.agents.types import AgentResponse
+from simulatrex.experiments.questions.question import Question
+from simulatrex.llms.utils.rate_limiter import count_tokens
+from simulatrex.utils.errors import BudgetExceededError
+from simulatrex.utils.log import SingletonLogger
+
+_logger = SingletonLogger
+
+PACKED_SYSTEM_PROMPT = """You answer questions on behalf of several independent people. Each item describes one person and one question. Answer every item fully in character of its person only, never let one item influence another."""
+
+
+class PackedAnswer(BaseModel):
+    answer: str = Field(..., description="The answer of the person")
+    comment: Optional[str] = Field(None, description="Short reasoning, optional")
+
+
+def render_persona(agent: Agent, shared_instructions: Optional[str] = None) -> str:
+    """Persona of an agent, its instructions only if not already shared."""
+    # Agent.data drops traits on agents without rules, read them directly
+    traits = agent._traits or agent.traits
+    persona = ", ".join(f"{k}: {v}" for k, v in traits.items())
+    persona = f"Persona: {persona or 'unspecified'}"
+    if agent.instructions == shared_instructions:
+        return persona
+    return f"{agent.instructions}\n{persona}"
+
+
+def common_instructions(items: List[Tuple[Agent, Question]]) -> Optional[str]:
+    """The most common agent instructions, sent once in the system prompt."""
+    counts = Counter(agent.instructions for agent, _ in items)
+    return counts.most_common(1)[0][0] if counts else None
+
+
+def packed_system_prompt(instructions: Optional[str]) -> str:
+    if not instructions:
+        return PACKED_SYSTEM_PROMPT
+    return (
+        f"{PACKED_SYSTEM_PROMPT}\n\nUnless an item gives its own instructions, "
+        f"every person follows these: {instructions}"
+    )
+
+
+def render_question(question: Question) -> str:
+    text = question.question_text
+    options = getattr(question, "question_options", None)
+    if options:
+        text += f"\nOptions: {json.dumps(list(options))}"
+    return text
+
+
+def render_item(
+    index: int,
+    agent: Agent,
+    question: Question,
+    shared_instructions: Optional[str] = None,
+) -> str:
+    return (
+        f"### Item {index}\n{render_persona(agent, shared_instructions)}\n"
+        f"Question: {render_question(question)}"
+    )
+
+
+def pack_items(
+    items: List[Tuple[Agent, Question]],
+    token_budget: int = 2000,
+    max_pack_size: int = 20,
+    shared_instructions: Optional[str] = None,
+) -> List[List[int]]:
+    """
+    Groups item indices into packs whose rendered prompt stays within the
+    token budget. An item larger than the budget gets a pack of its own.
+    """
+    packs = []
+    current, current_tokens = [], 0
+    for index, (agent, question) in enumerate(items):
+        tokens = count_tokens(render_item(index, agent, question, shared_instructions))
+        if current and (
+            current_tokens + tokens > token_budget or len(current) >= max_pack_size
+        ):
+            packs.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+
+class PromptPacker:
+    """
+    Answers short questions for many agents at once. Independent (agent,
+    question) pairs are bundled into one structured request per pack and
+    the answers are split back into one AgentResponse per pair. Answers
+    that are missing or fail Question.validate_response are retried with
+    a request of their own.
+
+    Instructions most agents share go into the system prompt once instead
+    of into every item, and each response records only its own item.
+    """
+
+    def __init__(
+        self,
+        llm,
+        token_budget: int = 2000,
+        max_pack_size: int = 20,
+        temperature: float = 0.9,
+    ):
+        self.llm = llm
+        self.token_budget = token_budget
+        self.max_pack_size = max_pack_size
+        self.temperature = temperature
+
+        self.packed_requests = 0
+        self.single_requests = 0
+
+    async def answer(
+        self, items: List[Tuple[Agent, Question]]
+    ) -> List[Optional[AgentResponse]]:
+        """Returns the responses in the order of items, None if an item failed."""
+        responses = [None] * len(items)
+        instructions = common_instructions(items)
+        packs = pack_items(items, self.token_budget, self.max_pack_size, instructions)
+
+        retry = []
+        for pack, answers in zip(
+            packs,
+            await asyncio.gather(
+                *[self._ask_pack(items, p, instructions) for p in packs]
+            ),
+        ):
+            for index in pack:
+                agent, question = items[index]
+                prompts = {
+                    "system_prompt": packed_system_prompt(instructions),
+                    "user_prompt": render_item(index, agent, question, instructions),
+                }
+                response = self._to_response(question, answers.get(index), prompts)
+                if response is None:
+                    retry.append(index)
+                else:
+                    responses[index] = response
+
+        if retry:
+            _logger.debug(f"Retrying {len(retry)} packed answers individually")
+            singles = await asyncio.gather(
+                *[self._ask_single(*items[index]) for index in retry]
+            )
+            for index, response in zip(retry, singles):
+                responses[index] = response
+        return responses
+
+    async def _ask_pack(
+        self, items, pack: List[int], instructions: Optional[str] = None
+    ) -> dict:
+        """Returns the raw answers of a pack keyed by item index."""
+        if len(pack) == 1:
+            # Nothing to share, the single request path validates it
+            return {}
+
+        response_model = create_model(
+            "PackedAnswers",
+            **{f"item_{index}": (Optional[PackedAnswer], None) for index in pack},
+        )
+        prompt = "\n\n".join(render_item(i, *items[i], instructions) for i in pack)
+        self.packed_requests += 1
+        try:
+            result = await self.llm.generate_structured_output(
+                prompt,
+                response_model,
+                context_prompt=packed_system_prompt(instructions),
+                temperature=self.temperature,
+            )
+        except BudgetExceededError:
+            # Item by item retries would be refused as well
+            raise
+        except Exception as e:
+            _logger.warning(f"Packed request for {len(pack)} items failed: {e}")
+            return {}
+        return {index: getattr(result, f"item_{index}", None) for index in pack}
+
+    async def _ask_single(
+        self, agent: Agent, question: Question
+    ) -> Optional[AgentResponse]:
+        prompts = {
+            "system_prompt": render_persona(agent),
+            "user_prompt": render_question(question),
+        }
+        self.single_requests += 1
+        try:
+            answer = await self.llm.generate_structured_output(
+                prompts["user_prompt"],
+                PackedAnswer,
+                context_prompt=prompts["system_prompt"],
+                temperature=self.temperature,
+            )
+        except BudgetExceededError:
+            raise
+        except Exception as e:
+            _logger.warning(f"Question {question.question_name} failed: {e}")
+            return None
+        return self._to_response(question, answer, prompts)
+
+    @staticmethod
+    def _to_response(
+        question: Question, answer: Optional[PackedAnswer], prompts: dict
+    ) -> Optional[AgentResponse]:
+        if answer is None:
+            return None
+        try:
+            validated = question.validate_response(answer.model_dump())
+        except Exception as e:
+            _logger.debug(f"Invalid answer to {question.question_name}: {e}")
+            return None
+        return AgentResponse(
+            question_name=question.question_name,
+            answer=validated["answer"],
+            comment=validated.get("comment"),
+            prompts=prompts,
+        )
+
+    def stats(self) -> dict:
+        return {
+            "packed_requests": self.packed_requests,
+            "single_requests": self.single_requests,
+        }
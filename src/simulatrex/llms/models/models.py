@@ -7,17 +7,48 @@ Description: LLM Models
 """
 
 import asyncio
+import hashlib
+import math
 import os
 import json
+import random
+import time
 from abc import ABC, abstractmethod
 import aiohttp
 
 from dotenv import load_dotenv
-from pydantic import BaseModel
-from openai import OpenAI
+from pydantic import BaseModel, ValidationError
+import openai
+from openai.types.chat import ChatCompletion
 import requests
-import instructor
+from simulatrex.config import global_config
 from simulatrex.llms.types import LanguageModel
+from simulatrex.llms.models.registry import client_registry
+from simulatrex.llms.utils.batch import get_batch_collector
+from simulatrex.llms.utils.cache import ResponseCache, get_default_response_cache
+from simulatrex.llms.utils.rate_limiter import (
+    count_tokens,
+    estimate_tokens,
+    get_rate_limiter,
+)
+from simulatrex.llms.utils.retry import (
+    RetryPolicy,
+    get_circuit_breaker,
+    parse_retry_after,
+)
+from simulatrex.llms.utils.schema import sample_from_schema
+from simulatrex.llms.utils.scheduler import get_request_scheduler
+from simulatrex.llms.utils.single_flight import single_flight
+from simulatrex.llms.utils.usage import check_budget, record_usage
+from simulatrex.utils.errors import (
+    LanguageModelAPIError,
+    LanguageModelEmptyResponseError,
+    LanguageModelExceptions,
+    LanguageModelRateLimitError,
+    LanguageModelResponseNotJSONError,
+    LanguageModelTimeoutError,
+)
+from simulatrex.utils.utils import extract_json_from_string
 
 load_dotenv()
 
@@ -28,10 +59,27 @@ _logger = SingletonLogger
 DEFAULT_SYSTEM_PROMPT = "This is a real-world like simulation. Try to answer the following questions as best as possible:"
 
 
+def response_usage(response):
+    """Returns the token usage of a completion, also for instructor models."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        # instructor keeps the raw completion next to the parsed model
+        usage = getattr(getattr(response, "_raw_response", None), "usage", None)
+    return usage
+
+
 class BaseLanguageModel(ABC):
+    model_id = None
+    agent_id = None
+    cache = None
+
     @abstractmethod
     async def ask(
-        self, prompt: str, context_prompt=DEFAULT_SYSTEM_PROMPT, temperature=0.9
+        self,
+        prompt: str,
+        context_prompt=DEFAULT_SYSTEM_PROMPT,
+        temperature=0.9,
+        coalesce=False,
     ) -> str:
         pass
 
@@ -42,16 +90,99 @@ class BaseLanguageModel(ABC):
         response_model: BaseModel,
         context_prompt=DEFAULT_SYSTEM_PROMPT,
         temperature=0.9,
+        coalesce=False,
     ) -> dict:
         pass
 
+    async def ask_stream(
+        self, prompt: str, context_prompt=DEFAULT_SYSTEM_PROMPT, temperature=0.9
+    ):
+        """
+        Yields the response in chunks as they are generated. Backends without
+        streaming support yield the whole response at once.
+        """
+        yield await self.ask(prompt, context_prompt, temperature)
+
+    def _report_usage(self, prompt_tokens: int, completion_tokens: int, latency: float):
+        record_usage(
+            self.model_id, self.agent_id, prompt_tokens, completion_tokens, latency
+        )
+
+    async def _execute(
+        self,
+        call,
+        prompt,
+        context_prompt,
+        temperature,
+        response_model=None,
+        coalesce=False,
+    ):
+        """
+        Runs a model call through the response cache, if enabled for it, and
+        with coalesce=True shares it with identical requests already in flight.
+        """
+        cache = self.cache
+        use_cache = cache is not None and cache.accepts(temperature)
+        if not use_cache and not coalesce:
+            return await call()
+
+        key = ResponseCache.make_key(
+            self.model_id, context_prompt, prompt, temperature, response_model
+        )
+
+        if use_cache:
+            cached = cache.get(key)
+            if cached is not None:
+                if self.agent_id:
+                    _logger.log_agent_response(self.agent_id, cached)
+                if response_model is not None:
+                    return response_model.model_validate_json(cached)
+                return cached
+
+        if coalesce:
+            response, shared = await single_flight.do(key, call)
+            if shared:
+                if self.agent_id:
+                    _logger.log_agent_response(
+                        self.agent_id,
+                        (
+                            response.model_dump_json()
+                            if response_model is not None
+                            else response
+                        ),
+                    )
+                # The caller that issued the request already filled the cache
+                return response
+        else:
+            response = await call()
+
+        if use_cache:
+            cache.set(
+                key,
+                response.model_dump_json() if response_model is not None else response,
+            )
+        return response
+
 
 class OpenAILanguageModel(BaseLanguageModel):
     """
     This is a wrapper for the OpenAI API.
     """
 
-    def __init__(self, model_id=LanguageModel.GPT_4, agent_id=None):
+    MODEL_IDS = (
+        LanguageModel.GPT_4_TURBO,
+        LanguageModel.GPT_4,
+        LanguageModel.GPT_3_5_Turbo,
+    )
+
+    def __init__(
+        self,
+        model_id=LanguageModel.GPT_4,
+        agent_id=None,
+        cache=None,
+        retry_policy=None,
+        batch=None,
+    ):
         api_key = os.environ.get("OPENAI_API_KEY")
 
         if api_key is None:
@@ -59,43 +190,34 @@ class OpenAILanguageModel(BaseLanguageModel):
                 "No OpenAI API key found. Please set OPENAI_API_KEY as environment variable."
             )
 
-        self.client = OpenAI(api_key=api_key)
+        # Shared per model and key, already patched by instructor
+        self.client = client_registry.openai_client(model_id, api_key)
         self.model_id = model_id
         self.agent_id = agent_id
-
-        # Patch the instructor
-        instructor.patch(self.client)
+        self.cache = cache if cache is not None else get_default_response_cache()
+        # Shared by every model instance with the same model id
+        self.rate_limiter = get_rate_limiter(model_id)
+        self.circuit_breaker = get_circuit_breaker(model_id)
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        # Set with LLM_EXECUTION_MODE=batch, streams always go out right away
+        self.batch = (
+            batch if batch is not None else get_batch_collector(model_id, self.client)
+        )
 
     async def ask(
-        self, prompt: str, context_prompt=DEFAULT_SYSTEM_PROMPT, temperature=1.0
+        self,
+        prompt: str,
+        context_prompt=DEFAULT_SYSTEM_PROMPT,
+        temperature=1.0,
+        coalesce=False,
     ) -> str:
-        try:
-            loop = asyncio.get_event_loop()
-            chat_completion = await loop.run_in_executor(
-                None,
-                lambda: self.client.chat.completions.create(
-                    messages=[
-                        {"role": "system", "content": context_prompt},
-                        {"role": "user", "content": prompt},
-                    ],
-                    model=self.model_id.value,
-                    temperature=temperature,
-                ),
-            )
-            response_message = chat_completion.choices[0].message.content
-
-            if response_message == None:
-                raise Exception("Empty response from OpenAI API")
-
-            # Log the response
-            if self.agent_id:
-                _logger.log_agent_response(self.agent_id, response_message)
-
-            return response_message
-        except Exception as e:
-            _logger.debug(f"Error: {e}")
-
-            raise Exception("Error in OpenAI API call")
+        return await self._execute(
+            lambda: self._ask(prompt, context_prompt, temperature),
+            prompt,
+            context_prompt,
+            temperature,
+            coalesce=coalesce,
+        )
 
     async def generate_structured_output(
         self,
@@ -103,41 +225,245 @@ class OpenAILanguageModel(BaseLanguageModel):
         response_model: BaseModel,
         context_prompt=DEFAULT_SYSTEM_PROMPT,
         temperature=1.0,
+        coalesce=False,
     ):
-        try:
-            loop = asyncio.get_event_loop()
-            structured_response = await loop.run_in_executor(
-                None,
-                lambda: self.client.chat.completions.create(
+        return await self._execute(
+            lambda: self._generate_structured_output(
+                prompt, response_model, context_prompt, temperature
+            ),
+            prompt,
+            context_prompt,
+            temperature,
+            response_model,
+            coalesce,
+        )
+
+    async def _create(
+        self, prompt: str, context_prompt: str, temperature: float, **kwargs
+    ):
+        """Sends a chat completion request, retried according to the retry policy."""
+        if self.batch is not None and not kwargs.get("stream"):
+            return await self._send_batch(prompt, context_prompt, temperature, **kwargs)
+        return await self.retry_policy.run(
+            lambda: self._send(prompt, context_prompt, temperature, **kwargs),
+            self.circuit_breaker,
+        )
+
+    async def _send(
+        self, prompt: str, context_prompt: str, temperature: float, **kwargs
+    ):
+        """Sends a single chat completion request, paced by the rate limiter."""
+        await check_budget()
+        estimated_tokens = estimate_tokens(context_prompt, prompt)
+        await self.rate_limiter.acquire(estimated_tokens)
+
+        # Taken after the waits, so sleeping requests hold no scheduler slot
+        async with get_request_scheduler().slot():
+            started = time.monotonic()
+            try:
+                response = await self.client.chat.completions.create(
                     messages=[
                         {"role": "system", "content": context_prompt},
                         {"role": "user", "content": prompt},
                     ],
-                    response_model=response_model,
                     model=self.model_id.value,
                     temperature=temperature,
-                ),
+                    **kwargs,
+                )
+            except Exception as e:
+                self.rate_limiter.reconcile(estimated_tokens, 0)
+                _logger.debug(f"Error: {e}")
+
+                raise self._translate_error(e) from e
+
+        usage = response_usage(response)
+        self.rate_limiter.reconcile(
+            estimated_tokens, usage.total_tokens if usage else estimated_tokens
+        )
+        # Streams carry no usage, ask_stream reports them once finished
+        if usage:
+            self._report_usage(
+                usage.prompt_tokens,
+                usage.completion_tokens,
+                time.monotonic() - started,
+            )
+        return response
+
+    async def _send_batch(
+        self,
+        prompt: str,
+        context_prompt: str,
+        temperature: float,
+        response_model: BaseModel = None,
+    ):
+        """
+        Queues the request for the next batch job and waits for its result.
+        Structured outputs are requested as a forced tool call, the way
+        instructor does it for realtime requests.
+        """
+        await check_budget()
+        body = {
+            "model": self.model_id.value,
+            "messages": [
+                {"role": "system", "content": context_prompt},
+                {"role": "user", "content": prompt},
+            ],
+            "temperature": temperature,
+        }
+        if response_model is not None:
+            name = response_model.__name__
+            body["tools"] = [
+                {
+                    "type": "function",
+                    "function": {
+                        "name": name,
+                        "parameters": response_model.model_json_schema(),
+                    },
+                }
+            ]
+            body["tool_choice"] = {"type": "function", "function": {"name": name}}
+
+        started = time.monotonic()
+        result = await self.batch.submit(body)
+        usage = result.get("usage") or {}
+        self._report_usage(
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+            time.monotonic() - started,
+        )
+
+        completion = ChatCompletion.model_validate(result)
+        if response_model is None:
+            return completion
+
+        tool_calls = completion.choices[0].message.tool_calls
+        if not tool_calls:
+            raise LanguageModelResponseNotJSONError("Batch response has no tool call")
+        try:
+            return response_model.model_validate_json(tool_calls[0].function.arguments)
+        except ValidationError as e:
+            raise LanguageModelResponseNotJSONError(
+                f"Batch response does not match {response_model.__name__}: {e}"
+            ) from e
+
+    @staticmethod
+    def _translate_error(error: Exception) -> LanguageModelExceptions:
+        if isinstance(error, LanguageModelExceptions):
+            return error
+        if isinstance(error, openai.RateLimitError):
+            return LanguageModelRateLimitError(
+                "OpenAI API rate limit exceeded",
+                retryable=True,
+                retry_after=parse_retry_after(error.response.headers),
             )
+        if isinstance(error, openai.APITimeoutError):
+            return LanguageModelTimeoutError(
+                "OpenAI API call timed out", retryable=True
+            )
+        if isinstance(error, openai.APIConnectionError):
+            return LanguageModelAPIError(
+                "Could not connect to the OpenAI API", retryable=True
+            )
+        if isinstance(error, openai.APIStatusError):
+            return LanguageModelAPIError(
+                f"OpenAI API returned status {error.status_code}",
+                retryable=error.status_code >= 500 or error.status_code in (408, 409),
+                retry_after=parse_retry_after(error.response.headers),
+            )
+        return LanguageModelAPIError(f"Error in OpenAI API call: {error}")
 
-            # Log the response
-            if self.agent_id:
-                # Convert the structured response to a readable string
-                response_string = json.dumps(structured_response, indent=4, default=str)
-                _logger.log_agent_response(self.agent_id, response_string)
+    async def ask_stream(
+        self, prompt: str, context_prompt=DEFAULT_SYSTEM_PROMPT, temperature=1.0
+    ):
+        started = time.monotonic()
+        # Retries only cover opening the stream, not a stream broken midway
+        stream = await self._create(prompt, context_prompt, temperature, stream=True)
 
-            return structured_response
+        chunks = []
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    chunks.append(content)
+                    yield content
         except Exception as e:
             _logger.debug(f"Error: {e}")
 
-            raise Exception("Error in OpenAI API call")
+            raise self._translate_error(e) from e
+
+        response_message = "".join(chunks)
+        if not response_message:
+            raise LanguageModelEmptyResponseError("Empty response from OpenAI API")
+
+        self._report_usage(
+            count_tokens(context_prompt, prompt),
+            count_tokens(response_message),
+            time.monotonic() - started,
+        )
+
+        # Log the response
+        if self.agent_id:
+            _logger.log_agent_response(self.agent_id, response_message)
+
+    async def _ask(self, prompt: str, context_prompt: str, temperature: float) -> str:
+        chat_completion = await self._create(prompt, context_prompt, temperature)
+        response_message = chat_completion.choices[0].message.content
+
+        if response_message == None:
+            raise LanguageModelEmptyResponseError("Empty response from OpenAI API")
+
+        # Log the response
+        if self.agent_id:
+            _logger.log_agent_response(self.agent_id, response_message)
+
+        return response_message
+
+    async def _generate_structured_output(
+        self,
+        prompt: str,
+        response_model: BaseModel,
+        context_prompt: str,
+        temperature: float,
+    ):
+        structured_response = await self._create(
+            prompt, context_prompt, temperature, response_model=response_model
+        )
+
+        # Log the response
+        if self.agent_id:
+            # Convert the structured response to a readable string
+            response_string = json.dumps(structured_response, indent=4, default=str)
+            _logger.log_agent_response(self.agent_id, response_string)
+
+        return structured_response
 
 
 class LlamaLanguageModel(BaseLanguageModel):
     """
-    This class is a wrapper for the LLama API.
+    This class is a wrapper for the LLama API. The Mistral instruct models
+    share its [INST] prompt format and are served through it as well.
     """
 
-    def __init__(self, model_id=LanguageModel.LLAMA_2_70B_CHAT_HF, agent_id=None):
+    API_BASE_URL = "https://api-inference.huggingface.co/models/"
+    MODEL_PATHS = {
+        LanguageModel.LLAMA_2_70B_CHAT_HF: "meta-llama/Llama-2-70b-chat-hf",
+        LanguageModel.LLAMA_2_13B_CHAT_HF: "meta-llama/Llama-2-13b-chat-hf",
+        LanguageModel.MISTRAL_7B_CHAT_HF: "mistralai/Mistral-7B-Instruct-v0.2",
+        LanguageModel.MIXTRAL_8x7B_INSTRUCT: "mistralai/Mixtral-8x7B-Instruct-v0.1",
+    }
+
+    def __init__(
+        self,
+        model_id=LanguageModel.LLAMA_2_70B_CHAT_HF,
+        agent_id=None,
+        api_url=None,
+        connector_limit=100,
+        dns_cache_ttl=300,
+        cache=None,
+        retry_policy=None,
+    ):
         access_token = os.environ.get("HUGGINGFACE_ACCESS_TOKEN")
 
         if access_token is None:
@@ -145,40 +471,476 @@ class LlamaLanguageModel(BaseLanguageModel):
                 "No Huggingface API key found. Please set HUGGINGFACE_API_KEY as environment variable."
             )
 
+        if api_url is None:
+            if model_id not in self.MODEL_PATHS:
+                raise Exception(f"Model {model_id} is not available on HuggingFace.")
+            api_url = self.API_BASE_URL + self.MODEL_PATHS[model_id]
+
         self.access_token = access_token
         self.model_id = model_id
         self.agent_id = agent_id
+        self.api_url = api_url
+        self.connector_limit = connector_limit
+        self.dns_cache_ttl = dns_cache_ttl
+        self.cache = cache if cache is not None else get_default_response_cache()
+        # Shared by every model instance with the same model id
+        self.rate_limiter = get_rate_limiter(model_id)
+        self.circuit_breaker = get_circuit_breaker(model_id)
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+
+        # Created lazily, aiohttp sessions must be created inside the event loop
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.connector_limit,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Authorization": f"Bearer {self.access_token}"},
+                timeout=aiohttp.ClientTimeout(
+                    total=float(global_config.get("API_CALL_TIMEOUT_SEC"))
+                ),
+            )
+        return self._session
+
+    async def close(self):
+        """Closes the keep-alive session and its connection pool."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @staticmethod
+    def _format_prompt(prompt: str, context_prompt: str) -> str:
+        return f"<s>[INST] <<SYS>>\n{context_prompt}\n<</SYS>>\n\n{prompt} [/INST]"
+
+    async def _generate(self, inputs: str, temperature: float) -> str:
+        """Runs a text generation request, retried according to the retry policy."""
+        return await self.retry_policy.run(
+            lambda: self._send(inputs, temperature), self.circuit_breaker
+        )
+
+    def _payload(self, inputs: str, temperature: float, stream: bool = False) -> dict:
+        return {
+            "inputs": inputs,
+            "stream": stream,
+            "options": {
+                "use_cache": False,
+                "wait_for_model": True,
+            },
+            "parameters": {
+                "max_length": 4096,
+                # The inference API rejects a temperature of exactly 0
+                "temperature": max(temperature, 0.01),
+                "return_full_text": False,
+            },
+        }
+
+    async def _post(self, payload: dict) -> aiohttp.ClientResponse:
+        """Posts a request and returns the response once its status is OK."""
+        response = await self._get_session().post(self.api_url, json=payload)
+        if response.status >= 400:
+            response.release()
+            raise LanguageModelAPIError(
+                f"HuggingFace API returned status {response.status}",
+                retryable=response.status >= 500 or response.status in (408, 429),
+                retry_after=parse_retry_after(response.headers),
+            )
+        return response
+
+    async def _send(self, inputs: str, temperature: float) -> str:
+        await check_budget()
+        estimated_tokens = estimate_tokens(inputs)
+        await self.rate_limiter.acquire(estimated_tokens)
 
-    async def ask(self, prompt: str) -> str:
-        if self.model_id == LanguageModel.LLAMA_2_70B_CHAT_HF:
+        # Taken after the waits, so sleeping requests hold no scheduler slot
+        async with get_request_scheduler().slot():
+            started = time.monotonic()
             try:
-                API_URL = "https://api-inference.huggingface.co/models/meta-llama/Llama-2-70b-chat-hf"
-                headers = {"Authorization": f"Bearer {self.access_token}"}
-
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        API_URL,
-                        headers=headers,
-                        json={
-                            "inputs": prompt,
-                            "options": {
-                                "use_cache": False,
-                                "wait_for_model": True,
-                            },
-                            "parameters": {
-                                "max_length": 4096,
-                            },
-                        },
-                    ) as response:
-                        result = await response.json()
-                        result_text = result["generated_text"]
-
-                # Log the response
-                if self.agent_id:
-                    _logger.log_agent_response(self.agent_id, result_text)
+                async with await self._post(
+                    self._payload(inputs, temperature)
+                ) as response:
+                    result = await response.json()
+            except Exception as e:
+                self.rate_limiter.reconcile(estimated_tokens, 0)
+                _logger.debug(f"Error: {e}")
 
-                return result_text
+                raise self._translate_error(e) from e
+
+        # Text generation endpoints answer with a list of generations
+        if isinstance(result, list):
+            result = result[0]
+        result_text = result.get("generated_text") if isinstance(result, dict) else None
+
+        if not result_text:
+            raise LanguageModelEmptyResponseError("Empty response from HuggingFace API")
+
+        # The inference API reports no usage, estimate it from the texts
+        self.rate_limiter.reconcile(estimated_tokens, count_tokens(inputs, result_text))
+        self._report_usage(
+            count_tokens(inputs), count_tokens(result_text), time.monotonic() - started
+        )
+        return result_text
+
+    @staticmethod
+    def _translate_error(error: Exception) -> LanguageModelExceptions:
+        if isinstance(error, LanguageModelExceptions):
+            return error
+        if isinstance(error, asyncio.TimeoutError):
+            return LanguageModelTimeoutError(
+                "HuggingFace API call timed out", retryable=True
+            )
+        if isinstance(error, aiohttp.ClientConnectionError):
+            return LanguageModelAPIError(
+                "Could not connect to the HuggingFace API", retryable=True
+            )
+        return LanguageModelAPIError(f"Error in HuggingFace API call: {error}")
+
+    async def ask(
+        self,
+        prompt: str,
+        context_prompt=DEFAULT_SYSTEM_PROMPT,
+        temperature=0.9,
+        coalesce=False,
+    ) -> str:
+        return await self._execute(
+            lambda: self._ask(prompt, context_prompt, temperature),
+            prompt,
+            context_prompt,
+            temperature,
+            coalesce=coalesce,
+        )
+
+    async def generate_structured_output(
+        self,
+        prompt: str,
+        response_model: BaseModel,
+        context_prompt=DEFAULT_SYSTEM_PROMPT,
+        temperature=0.9,
+        coalesce=False,
+    ):
+        return await self._execute(
+            lambda: self._generate_structured_output(
+                prompt, response_model, context_prompt, temperature
+            ),
+            prompt,
+            context_prompt,
+            temperature,
+            response_model,
+            coalesce,
+        )
+
+    async def ask_stream(
+        self, prompt: str, context_prompt=DEFAULT_SYSTEM_PROMPT, temperature=0.9
+    ):
+        inputs = self._format_prompt(prompt, context_prompt)
+        estimated_tokens = estimate_tokens(inputs)
+        started = time.monotonic()
+        # Retries only cover opening the stream, not a stream broken midway
+        response = await self.retry_policy.run(
+            lambda: self._open_stream(inputs, temperature, estimated_tokens),
+            self.circuit_breaker,
+        )
+
+        chunks = []
+        try:
+            # Server sent events, one "data:{...}" line per generated token
+            async for line in response.content:
+                line = line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                token = json.loads(line[len("data:") :]).get("token") or {}
+                if token.get("special") or not token.get("text"):
+                    continue
+                chunks.append(token["text"])
+                yield token["text"]
+        except Exception as e:
+            _logger.debug(f"Error: {e}")
+
+            raise self._translate_error(e) from e
+        finally:
+            response.release()
+
+        result_text = "".join(chunks)
+        self.rate_limiter.reconcile(estimated_tokens, count_tokens(inputs, result_text))
+        self._report_usage(
+            count_tokens(inputs), count_tokens(result_text), time.monotonic() - started
+        )
+
+        # Log the response
+        if self.agent_id:
+            _logger.log_agent_response(self.agent_id, result_text)
+
+    async def _open_stream(
+        self, inputs: str, temperature: float, estimated_tokens: int
+    ) -> aiohttp.ClientResponse:
+        await check_budget()
+        await self.rate_limiter.acquire(estimated_tokens)
+        async with get_request_scheduler().slot():
+            try:
+                return await self._post(self._payload(inputs, temperature, stream=True))
             except Exception as e:
+                self.rate_limiter.reconcile(estimated_tokens, 0)
                 _logger.debug(f"Error: {e}")
 
-                raise Exception("Error in HuggingFace API call")
+                raise self._translate_error(e) from e
+
+    async def _ask(self, prompt: str, context_prompt: str, temperature: float) -> str:
+        result_text = await self._generate(
+            self._format_prompt(prompt, context_prompt), temperature
+        )
+
+        # Log the response
+        if self.agent_id:
+            _logger.log_agent_response(self.agent_id, result_text)
+
+        return result_text
+
+    async def _generate_structured_output(
+        self,
+        prompt: str,
+        response_model: BaseModel,
+        context_prompt: str,
+        temperature: float,
+    ):
+        schema = json.dumps(response_model.model_json_schema())
+        structured_prompt = (
+            f"{prompt}\n\nRespond only with a JSON object that matches this JSON schema:\n"
+            f"{schema}"
+        )
+
+        result_text = await self._generate(
+            self._format_prompt(structured_prompt, context_prompt), temperature
+        )
+
+        try:
+            structured_response = response_model.model_validate_json(
+                extract_json_from_string(result_text)
+            )
+        except (ValueError, ValidationError) as e:
+            _logger.debug(f"Error: {e}")
+
+            raise LanguageModelResponseNotJSONError(
+                "HuggingFace response does not match the response model"
+            )
+
+        # Log the response
+        if self.agent_id:
+            _logger.log_agent_response(
+                self.agent_id, structured_response.model_dump_json(indent=4)
+            )
+
+        return structured_response
+
+
+class MockLanguageModel(BaseLanguageModel):
+    """
+    Offline language model for load tests and benchmarks. Responses are
+    derived from a hash of the seed and the request, so identical requests
+    always get identical answers. Latency and failures are drawn from a
+    seeded random generator to mimic a real backend.
+    """
+
+    LATENCY_DISTRIBUTIONS = (
+        "constant",
+        "uniform",
+        "normal",
+        "lognormal",
+        "exponential",
+    )
+
+    def __init__(
+        self,
+        model_id=LanguageModel.MOCK,
+        agent_id=None,
+        seed=None,
+        latency=None,
+        latency_distribution=None,
+        error_rate=None,
+        cache=None,
+        retry_policy=None,
+    ):
+        self.model_id = model_id
+        self.agent_id = agent_id
+        self.seed = (
+            seed if seed is not None else int(global_config.get("MOCK_LLM_SEED"))
+        )
+        # Mean latency in seconds
+        self.latency = (
+            latency
+            if latency is not None
+            else float(global_config.get("MOCK_LLM_LATENCY_MS")) / 1000.0
+        )
+        self.latency_distribution = latency_distribution or global_config.get(
+            "MOCK_LLM_LATENCY_DISTRIBUTION"
+        )
+        if self.latency_distribution not in self.LATENCY_DISTRIBUTIONS:
+            raise ValueError(
+                f"Unknown latency distribution {self.latency_distribution}"
+            )
+        self.error_rate = (
+            error_rate
+            if error_rate is not None
+            else float(global_config.get("MOCK_LLM_ERROR_RATE"))
+        )
+        self.cache = cache if cache is not None else get_default_response_cache()
+        self.circuit_breaker = get_circuit_breaker(model_id)
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+
+        self._random = random.Random(self.seed)
+        self.calls = 0
+
+    async def ask(
+        self,
+        prompt: str,
+        context_prompt=DEFAULT_SYSTEM_PROMPT,
+        temperature=0.9,
+        coalesce=False,
+    ) -> str:
+        return await self._execute(
+            lambda: self._ask(prompt, context_prompt, temperature),
+            prompt,
+            context_prompt,
+            temperature,
+            coalesce=coalesce,
+        )
+
+    async def generate_structured_output(
+        self,
+        prompt: str,
+        response_model: BaseModel,
+        context_prompt=DEFAULT_SYSTEM_PROMPT,
+        temperature=0.9,
+        coalesce=False,
+    ):
+        return await self._execute(
+            lambda: self._generate_structured_output(
+                prompt, response_model, context_prompt, temperature
+            ),
+            prompt,
+            context_prompt,
+            temperature,
+            response_model,
+            coalesce,
+        )
+
+    def _sample_latency(self) -> float:
+        mean = self.latency
+        if mean <= 0:
+            return 0.0
+        if self.latency_distribution == "uniform":
+            return self._random.uniform(0, 2 * mean)
+        if self.latency_distribution == "normal":
+            return max(0.0, self._random.gauss(mean, mean / 2))
+        if self.latency_distribution == "lognormal":
+            # Long tailed like real APIs, sigma 0.5 with the given mean
+            sigma = 0.5
+            return self._random.lognormvariate(math.log(mean) - sigma**2 / 2, sigma)
+        if self.latency_distribution == "exponential":
+            return self._random.expovariate(1 / mean)
+        return mean
+
+    async def _send(self):
+        """Simulates the round trip to a backend."""
+        await check_budget()
+        async with get_request_scheduler().slot():
+            self.calls += 1
+            await asyncio.sleep(self._sample_latency())
+        if self._random.random() < self.error_rate:
+            raise LanguageModelAPIError("Injected mock backend error", retryable=True)
+
+    def _request_random(self, *parts) -> random.Random:
+        digest = hashlib.sha256(
+            json.dumps([self.seed, self.model_id.value, *parts], default=str).encode(
+                "utf-8"
+            )
+        ).hexdigest()
+        return random.Random(digest)
+
+    async def _ask(self, prompt: str, context_prompt: str, temperature: float) -> str:
+        started = time.monotonic()
+        await self.retry_policy.run(self._send, self.circuit_breaker)
+
+        rng = self._request_random(context_prompt, prompt, temperature)
+        response_message = f"Mock response {rng.getrandbits(32):08x} to: {prompt[:80]}"
+        self._report_usage(
+            count_tokens(context_prompt, prompt),
+            count_tokens(response_message),
+            time.monotonic() - started,
+        )
+
+        # Log the response
+        if self.agent_id:
+            _logger.log_agent_response(self.agent_id, response_message)
+
+        return response_message
+
+    async def _generate_structured_output(
+        self,
+        prompt: str,
+        response_model: BaseModel,
+        context_prompt: str,
+        temperature: float,
+    ):
+        started = time.monotonic()
+        await self.retry_policy.run(self._send, self.circuit_breaker)
+
+        rng = self._request_random(
+            context_prompt, prompt, temperature, response_model.model_json_schema()
+        )
+        structured_response = mock_instance(response_model, rng)
+        self._report_usage(
+            count_tokens(context_prompt, prompt),
+            count_tokens(structured_response.model_dump_json()),
+            time.monotonic() - started,
+        )
+
+        # Log the response
+        if self.agent_id:
+            _logger.log_agent_response(
+                self.agent_id, structured_response.model_dump_json(indent=4)
+            )
+
+        return structured_response
+
+
+def mock_instance(model: type[BaseModel], rng: random.Random) -> BaseModel:
+    """Builds an instance of a pydantic model filled with random valid values."""
+    data = sample_from_schema(model.model_json_schema(), rng)
+    try:
+        return model.model_validate(data)
+    except ValidationError as e:
+        # Constraints the sampler does not cover, like custom validators
+        raise LanguageModelResponseNotJSONError(
+            f"Mock response does not match {model.__name__}: {e}"
+        ) from e
+
+
+def create_language_model(
+    model_id=LanguageModel.GPT_4, agent_id=None, **kwargs
+) -> BaseLanguageModel:
+    """
+    Returns the language model implementation for a model id. With
+    LLM_BACKEND=mock every model id is served by the offline mock backend.
+    A list of model ids returns a router across them.
+    """
+    if isinstance(model_id, (list, tuple)):
+        from simulatrex.llms.models.router import RouterLanguageModel
+
+        return RouterLanguageModel(model_ids=model_id, agent_id=agent_id, **kwargs)
+    if model_id == LanguageModel.MOCK or global_config.get("LLM_BACKEND") == "mock":
+        return MockLanguageModel(model_id=model_id, agent_id=agent_id, **kwargs)
+    if model_id in LlamaLanguageModel.MODEL_PATHS:
+        return LlamaLanguageModel(model_id=model_id, agent_id=agent_id, **kwargs)
+    if model_id in OpenAILanguageModel.MODEL_IDS:
+        return OpenAILanguageModel(model_id=model_id, agent_id=agent_id, **kwargs)
+    raise ValueError(f"No backend serves model {model_id}")
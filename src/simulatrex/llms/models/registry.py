@@ -0,0 +1,111 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: registry.py
+Description: Process-wide registry of shared LLM clients
+
+"""
+
+import asyncio
+import atexit
+import hashlib
+import threading
+from enum import Enum
+
+import httpx
+import instructor
+from openai import AsyncOpenAI
+
+from simulatrex.config import global_config
+from simulatrex.utils.log import SingletonLogger
+
+_logger = SingletonLogger
+
+
+class ClientRegistry:
+    """
+    Hands out one shared client per (provider, model, credentials) so that
+    agents reuse a single connection pool instead of building their own.
+    Clients are created under a lock and are safe to share across threads.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(provider: str, model_id, credentials: str):
+        model = model_id.value if isinstance(model_id, Enum) else model_id
+        # Never keep raw credentials around as part of the key
+        fingerprint = (
+            hashlib.sha256(credentials.encode("utf-8")).hexdigest()
+            if credentials
+            else None
+        )
+        return (provider, model, fingerprint)
+
+    def get_or_create(self, provider: str, model_id, credentials: str, factory):
+        key = self._key(provider, model_id, credentials)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    _logger.debug(f"Creating shared {provider} client for {key[1]}")
+                    client = factory()
+                    self._clients[key] = client
+        return client
+
+    def openai_client(self, model_id, api_key: str) -> AsyncOpenAI:
+        """
+        Returns the shared, instructor patched async OpenAI client. Requests
+        are multiplexed over its connection pool, no thread per request.
+        """
+
+        def factory():
+            client = AsyncOpenAI(
+                api_key=api_key,
+                http_client=httpx.AsyncClient(limits=connection_limits()),
+                timeout=float(global_config.get("API_CALL_TIMEOUT_SEC")),
+                # Retries are handled by the model's RetryPolicy
+                max_retries=0,
+            )
+            instructor.patch(client)
+            return client
+
+        return self.get_or_create("openai", model_id, api_key, factory)
+
+    async def aclose(self):
+        """Closes all shared clients and their connection pools."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                _logger.debug(f"Error while closing client: {e}")
+
+    def shutdown(self):
+        """Synchronous shutdown hook, use aclose() from async code."""
+        if not self._clients:
+            return
+        try:
+            asyncio.run(self.aclose())
+        except Exception as e:
+            _logger.debug(f"Error while shutting down client registry: {e}")
+
+
+def connection_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(global_config.get("LLM_MAX_CONNECTIONS")),
+        max_keepalive_connections=int(
+            global_config.get("LLM_MAX_KEEPALIVE_CONNECTIONS")
+        ),
+    )
+
+
+# Export singleton
+client_registry = ClientRegistry()
+atexit.register(client_registry.shutdown)
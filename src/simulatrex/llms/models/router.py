@@ -0,0 +1,284 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: router.py
+Description: Routes LLM calls across backends by latency, errors and cost
+
+"""
+
+import time
+from collections import deque
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from simulatrex.llms.models.models import (
+    DEFAULT_SYSTEM_PROMPT,
+    BaseLanguageModel,
+    create_language_model,
+)
+from simulatrex.llms.types import LanguageModel
+from simulatrex.llms.utils.retry import CircuitState
+from simulatrex.llms.utils.usage import COST_PER_1K_TOKENS
+from simulatrex.utils.errors import LanguageModelAPIError
+from simulatrex.utils.log import SingletonLogger
+
+_logger = SingletonLogger
+
+
+def percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class BackendStats:
+    """Rolling latency and error statistics of one backend."""
+
+    def __init__(self, window: int = 100):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.calls = 0
+        self.failures = 0
+        self.last_used = 0.0
+
+    def record(self, latency: float, success: bool):
+        self.calls += 1
+        self.last_used = time.monotonic()
+        self.outcomes.append(success)
+        if success:
+            self.latencies.append(latency)
+        else:
+            self.failures += 1
+
+    @property
+    def p50(self) -> Optional[float]:
+        return percentile(self.latencies, 0.5)
+
+    @property
+    def p95(self) -> Optional[float]:
+        return percentile(self.latencies, 0.95)
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "p50": self.p50,
+            "p95": self.p95,
+            "error_rate": self.error_rate,
+        }
+
+
+class RouterLanguageModel(BaseLanguageModel):
+    """
+    Sends each call to the backend with the lowest score, a weighted sum of
+    its p95 latency, recent error rate and price per 1K tokens. Backends
+    whose circuit breaker is open or whose error rate is above
+    max_error_rate count as degraded and are only tried last. A failing
+    call fails over to the next backend in line. Backends left unused for
+    probe_interval seconds are tried first once, so stale stats recover.
+    """
+
+    def __init__(
+        self,
+        model_ids: List[LanguageModel] = None,
+        agent_id=None,
+        backends: List[BaseLanguageModel] = None,
+        latency_weight: float = 1.0,
+        error_weight: float = 10.0,
+        cost_weight: float = 10.0,
+        max_error_rate: float = 0.5,
+        min_samples: int = 5,
+        probe_interval: float = 60.0,
+        window: int = 100,
+        history: int = 200,
+    ):
+        if backends is None:
+            if not model_ids:
+                raise ValueError("Router needs at least one model id or backend")
+            backends = [
+                create_language_model(model_id=model_id, agent_id=agent_id)
+                for model_id in model_ids
+            ]
+
+        self.backends = backends
+        self.model_id = backends[0].model_id
+        self.agent_id = agent_id
+        self.latency_weight = latency_weight
+        self.error_weight = error_weight
+        self.cost_weight = cost_weight
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.probe_interval = probe_interval
+
+        self.stats_by_backend = {id(b): BackendStats(window) for b in backends}
+        # Recent routing decisions, newest last
+        self.decisions = deque(maxlen=history)
+
+    def _name(self, backend: BaseLanguageModel) -> str:
+        return getattr(backend.model_id, "value", str(backend.model_id))
+
+    def is_degraded(self, backend: BaseLanguageModel) -> bool:
+        breaker = getattr(backend, "circuit_breaker", None)
+        if breaker is not None and breaker.state == CircuitState.OPEN:
+            return True
+        stats = self.stats_by_backend[id(backend)]
+        return (
+            len(stats.outcomes) >= self.min_samples
+            and stats.error_rate > self.max_error_rate
+        )
+
+    def score(self, backend: BaseLanguageModel) -> float:
+        stats = self.stats_by_backend[id(backend)]
+        # Unmeasured backends score as instant so they get sampled once
+        latency = stats.p95 or 0.0
+        cost = sum(COST_PER_1K_TOKENS.get(backend.model_id, (0.0, 0.0))) / 2
+        return (
+            self.latency_weight * latency
+            + self.error_weight * stats.error_rate
+            + self.cost_weight * cost
+        )
+
+    def needs_probe(self, backend: BaseLanguageModel) -> bool:
+        stats = self.stats_by_backend[id(backend)]
+        return (
+            stats.calls > 0 and time.monotonic() - stats.last_used > self.probe_interval
+        )
+
+    def rank(self) -> List[BaseLanguageModel]:
+        """Returns the backends in the order they will be tried."""
+        return sorted(
+            self.backends,
+            key=lambda b: (
+                self.is_degraded(b),
+                not self.needs_probe(b),
+                self.score(b),
+            ),
+        )
+
+    def _decide(self, candidates: List[BaseLanguageModel]):
+        decision = {
+            "time": time.time(),
+            "chosen": self._name(candidates[0]),
+            "candidates": [
+                {
+                    "model": self._name(b),
+                    "score": round(self.score(b), 4),
+                    "degraded": self.is_degraded(b),
+                }
+                for b in candidates
+            ],
+            "failovers": [],
+        }
+        self.decisions.append(decision)
+        _logger.debug(f"Routing to {decision['chosen']}")
+        return decision
+
+    async def _route(self, call):
+        candidates = self.rank()
+        decision = self._decide(candidates)
+
+        last_error = None
+        for backend in candidates:
+            started = time.monotonic()
+            try:
+                result = await call(backend)
+            except LanguageModelAPIError as e:
+                self.stats_by_backend[id(backend)].record(
+                    time.monotonic() - started, False
+                )
+                decision["failovers"].append(self._name(backend))
+                _logger.warning(f"Backend {self._name(backend)} failed: {e}")
+                last_error = e
+                continue
+
+            self.stats_by_backend[id(backend)].record(time.monotonic() - started, True)
+            decision["served_by"] = self._name(backend)
+            return result
+
+        raise last_error
+
+    async def ask(
+        self,
+        prompt: str,
+        context_prompt=DEFAULT_SYSTEM_PROMPT,
+        temperature=0.9,
+        coalesce=False,
+    ) -> str:
+        return await self._route(
+            lambda backend: backend.ask(prompt, context_prompt, temperature, coalesce)
+        )
+
+    async def generate_structured_output(
+        self,
+        prompt: str,
+        response_model: BaseModel,
+        context_prompt=DEFAULT_SYSTEM_PROMPT,
+        temperature=0.9,
+        coalesce=False,
+    ):
+        return await self._route(
+            lambda backend: backend.generate_structured_output(
+                prompt, response_model, context_prompt, temperature, coalesce
+            )
+        )
+
+    async def ask_stream(
+        self, prompt: str, context_prompt=DEFAULT_SYSTEM_PROMPT, temperature=0.9
+    ):
+        candidates = self.rank()
+        decision = self._decide(candidates)
+
+        last_error = None
+        for backend in candidates:
+            started = time.monotonic()
+            stream = backend.ask_stream(prompt, context_prompt, temperature)
+            try:
+                # Fail over only while nothing has been yielded yet
+                first_chunk = await stream.__anext__()
+            except StopAsyncIteration:
+                first_chunk = None
+            except LanguageModelAPIError as e:
+                self.stats_by_backend[id(backend)].record(
+                    time.monotonic() - started, False
+                )
+                decision["failovers"].append(self._name(backend))
+                _logger.warning(f"Backend {self._name(backend)} failed: {e}")
+                last_error = e
+                continue
+
+            decision["served_by"] = self._name(backend)
+            if first_chunk is not None:
+                yield first_chunk
+                async for chunk in stream:
+                    yield chunk
+            self.stats_by_backend[id(backend)].record(time.monotonic() - started, True)
+            return
+
+        raise last_error
+
+    def stats(self) -> dict:
+        served = {}
+        for decision in self.decisions:
+            model = decision.get("served_by")
+            if model is not None:
+                served[model] = served.get(model, 0) + 1
+        return {
+            "backends": {
+                self._name(b): {
+                    **self.stats_by_backend[id(b)].to_dict(),
+                    "score": self.score(b),
+                    "degraded": self.is_degraded(b),
+                }
+                for b in self.backends
+            },
+            "served": served,
+            "failovers": sum(len(d["failovers"]) for d in self.decisions),
+        }
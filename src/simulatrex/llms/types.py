@@ -6,6 +6,7 @@ Description: Types for the LLMs
 
 """
 
+import asyncio
 from enum import Enum
 from simulatrex.llms.utils.memory import LongTermMemory, ShortTermMemory
 
@@ -18,6 +19,7 @@ class LanguageModel(Enum):
     LLAMA_2_13B_CHAT_HF = "llama-2-13b-chat-hf"
     MISTRAL_7B_CHAT_HF = "mistral-7b-chat-hf"
     MIXTRAL_8x7B_INSTRUCT = "mixtral-8x7B-instruct-v0.1"
+    MOCK = "mock"
 
 
 class AgentType(Enum):
@@ -25,7 +27,29 @@ class AgentType(Enum):
 
 
 class AgentMemory:
-    def __init__(self, id: str, decay_factor: int) -> None:
+    def __init__(
+        self,
+        id: str,
+        decay_factor: int,
+        vector_db_backend: str = None,
+        simulation_id: str = None,
+    ) -> None:
         self.decay_factor = decay_factor
-        self.short_term_memory = ShortTermMemory(id, decay_factor)
-        self.long_term_memory = LongTermMemory(id)
+        # "chroma" or "memory", defaults to VECTOR_DB_BACKEND
+        self.short_term_memory = ShortTermMemory(
+            id,
+            decay_factor,
+            vector_db_backend=vector_db_backend,
+            simulation_id=simulation_id,
+        )
+        self.long_term_memory = LongTermMemory(id, simulation_id=simulation_id)
+
+    def flush(self):
+        """Writes buffered memories, call at the end of every epoch."""
+        self.short_term_memory.flush()
+        self.long_term_memory.flush()
+
+    async def aflush(self):
+        await asyncio.gather(
+            self.short_term_memory.aflush(), self.long_term_memory.aflush()
+        )
@@ -0,0 +1,353 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: batch.py
+Description: Collects LLM calls into batch jobs for high throughput runs
+
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional
+
+from simulatrex.config import global_config
+from simulatrex.llms.utils.rate_limiter import count_tokens
+from simulatrex.llms.utils.schema import sample_from_schema
+from simulatrex.utils.errors import LanguageModelAPIError
+from simulatrex.utils.log import SingletonLogger
+
+_logger = SingletonLogger
+
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+
+
+def batch_request_line(custom_id: str, body: dict) -> str:
+    return json.dumps(
+        {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": CHAT_COMPLETIONS_URL,
+            "body": body,
+        }
+    )
+
+
+def parse_batch_output(lines) -> Dict[str, dict]:
+    """Maps custom ids to response bodies, failed requests to an error dict."""
+    results = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        response = entry.get("response") or {}
+        if entry.get("error") or response.get("status_code", 200) >= 400:
+            results[entry["custom_id"]] = {
+                "error": entry.get("error") or response.get("body")
+            }
+        else:
+            results[entry["custom_id"]] = response.get("body")
+    return results
+
+
+class BatchBackend(ABC):
+    """A provider endpoint that runs a file of requests asynchronously."""
+
+    @abstractmethod
+    async def submit(self, lines: List[str]) -> str:
+        """Submits JSONL request lines and returns the batch id."""
+        pass
+
+    @abstractmethod
+    async def poll(self, batch_id: str) -> Optional[Dict[str, dict]]:
+        """Returns the results by custom id, or None while still running."""
+        pass
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Runs batches through the OpenAI Batch API."""
+
+    FAILED_STATES = ("failed", "expired", "cancelled")
+
+    def __init__(self, client, completion_window: str = "24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    async def submit(self, lines: List[str]) -> str:
+        request_file = await self.client.files.create(
+            file=("batch.jsonl", io.BytesIO("\n".join(lines).encode("utf-8"))),
+            purpose="batch",
+        )
+        batch = await self.client.batches.create(
+            input_file_id=request_file.id,
+            endpoint=CHAT_COMPLETIONS_URL,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    async def poll(self, batch_id: str) -> Optional[Dict[str, dict]]:
+        batch = await self.client.batches.retrieve(batch_id)
+        if batch.status in self.FAILED_STATES:
+            raise LanguageModelAPIError(f"Batch {batch_id} {batch.status}")
+        if batch.status != "completed":
+            return None
+
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = await self.client.files.content(file_id)
+                results.update(parse_batch_output(content.text.splitlines()))
+        return results
+
+
+def local_response(body: dict) -> dict:
+    """Deterministic stand-in completion for a chat completion request body."""
+    seed = hashlib.sha256(json.dumps(body, sort_keys=True).encode()).digest()
+    rng = random.Random(seed)
+    message = {"role": "assistant", "content": None}
+
+    tools = body.get("tools")
+    if tools:
+        function = tools[0]["function"]
+        message["tool_calls"] = [
+            {
+                "id": f"call_{rng.getrandbits(32):08x}",
+                "type": "function",
+                "function": {
+                    "name": function["name"],
+                    "arguments": json.dumps(
+                        sample_from_schema(function["parameters"], rng)
+                    ),
+                },
+            }
+        ]
+    else:
+        prompt = body["messages"][-1]["content"]
+        message["content"] = (
+            f"Batch response {rng.getrandbits(32):08x} to: {prompt[:80]}"
+        )
+
+    prompt_tokens = count_tokens(*[m["content"] for m in body["messages"]])
+    completion_tokens = count_tokens(
+        message["content"] or json.dumps(message.get("tool_calls"))
+    )
+    return {
+        "id": f"chatcmpl-{rng.getrandbits(64):016x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body["model"],
+        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+class LocalFileBatchBackend(BatchBackend):
+    """
+    Stand-in for a provider batch endpoint. Request files are written to
+    directory as <batch_id>_input.jsonl and results are read from
+    <batch_id>_output.jsonl. If no output file shows up within
+    completion_delay seconds, responder fills it in.
+    """
+
+    def __init__(
+        self,
+        directory: str = None,
+        completion_delay: float = 0.0,
+        responder: Optional[Callable[[dict], dict]] = local_response,
+    ):
+        self.directory = directory or os.path.join(os.getcwd(), "llm_batches")
+        self.completion_delay = completion_delay
+        self.responder = responder
+        self._submitted = {}
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def _path(self, batch_id: str, kind: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}_{kind}.jsonl")
+
+    async def submit(self, lines: List[str]) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        with open(self._path(batch_id, "input"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+        self._submitted[batch_id] = time.monotonic()
+        return batch_id
+
+    def _complete(self, batch_id: str):
+        with open(self._path(batch_id, "input")) as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        with open(self._path(batch_id, "output"), "w") as f:
+            for request in requests:
+                entry = {
+                    "id": f"batch_req_{uuid.uuid4().hex}",
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": self.responder(request["body"]),
+                    },
+                    "error": None,
+                }
+                f.write(json.dumps(entry) + "\n")
+
+    async def poll(self, batch_id: str) -> Optional[Dict[str, dict]]:
+        output_path = self._path(batch_id, "output")
+        if not os.path.exists(output_path):
+            submitted = self._submitted.get(batch_id, time.monotonic())
+            if (
+                self.responder is None
+                or time.monotonic() - submitted < self.completion_delay
+            ):
+                return None
+            self._complete(batch_id)
+
+        with open(output_path) as f:
+            return parse_batch_output(f)
+
+
+class BatchCollector:
+    """
+    Collects chat completion requests until max_batch_size are pending or
+    flush_interval seconds passed since the first one, submits them as one
+    batch and resolves every caller's future once the batch has finished.
+    """
+
+    def __init__(
+        self,
+        backend: BatchBackend,
+        max_batch_size: int = 50_000,
+        flush_interval: float = 5.0,
+        poll_interval: float = 30.0,
+    ):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+
+        self._pending = []
+        self._flush_task = None
+        self._tasks = set()
+
+        self.batches = 0
+        self.requests = 0
+
+    async def submit(self, body: dict) -> dict:
+        """Queues a request body and returns its response body when done."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((f"request-{uuid.uuid4().hex}", body, future))
+        self.requests += 1
+
+        if len(self._pending) >= self.max_batch_size:
+            self._spawn(self.flush())
+        elif self._flush_task is None:
+            self._flush_task = self._spawn(self._flush_later())
+        return await future
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Submits everything pending right away."""
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        futures = {custom_id: future for custom_id, _, future in pending}
+        try:
+            batch_id = await self.backend.submit(
+                [batch_request_line(custom_id, body) for custom_id, body, _ in pending]
+            )
+        except Exception as e:
+            self._fail(futures, e)
+            return
+
+        self.batches += 1
+        _logger.info(f"Submitted batch {batch_id} with {len(pending)} requests")
+        await self._wait(batch_id, futures)
+
+    async def _wait(self, batch_id: str, futures: Dict[str, asyncio.Future]):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                results = await self.backend.poll(batch_id)
+            except Exception as e:
+                self._fail(futures, e)
+                return
+            if results is not None:
+                break
+
+        _logger.info(f"Batch {batch_id} completed")
+        for custom_id, future in futures.items():
+            if future.done():
+                continue
+            result = results.get(custom_id)
+            if result is None or "error" in result:
+                future.set_exception(
+                    LanguageModelAPIError(
+                        f"Batch request failed: {result['error'] if result else 'no result'}"
+                    )
+                )
+            else:
+                future.set_result(result)
+
+    @staticmethod
+    def _fail(futures: Dict[str, asyncio.Future], error: Exception):
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(
+                    error
+                    if isinstance(error, LanguageModelAPIError)
+                    else LanguageModelAPIError(f"Batch submission failed: {error}")
+                )
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "pending": len(self._pending),
+        }
+
+
+_batch_collectors = {}
+_batch_collectors_lock = threading.Lock()
+
+
+def get_batch_collector(model_id, client) -> Optional[BatchCollector]:
+    """
+    Returns the collector shared by all models with this model id, or None
+    unless LLM_EXECUTION_MODE=batch. Batches hold requests for one model.
+    """
+    if global_config.get("LLM_EXECUTION_MODE") != "batch":
+        return None
+
+    collector = _batch_collectors.get(model_id)
+    if collector is None:
+        with _batch_collectors_lock:
+            collector = _batch_collectors.get(model_id)
+            if collector is None:
+                if global_config.get("LLM_BATCH_BACKEND") == "local":
+                    collector = BatchCollector(
+                        LocalFileBatchBackend(), flush_interval=1.0, poll_interval=0.5
+                    )
+                else:
+                    collector = BatchCollector(OpenAIBatchBackend(client))
+                _batch_collectors[model_id] = collector
+    return collector
@@ -0,0 +1,384 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: cache.py
+Description: Content-addressed LLM response cache with memory and SQLite tiers
+
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from enum import Enum
+from typing import Optional
+
+from sqlalchemy import (
+    Column,
+    Float,
+    String,
+    Text,
+    bindparam,
+    create_engine,
+    func,
+    select,
+    update,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from simulatrex.config import global_config
+from simulatrex.utils.log import SingletonLogger
+
+_logger = SingletonLogger
+
+CacheBase = declarative_base()
+
+
+class EvictionPolicy(Enum):
+    LRU = "lru"
+    FIFO = "fifo"
+
+
+class CachedResponseDB(CacheBase):
+    __tablename__ = "cached_responses"
+
+    key = Column(String, primary_key=True)
+    value = Column(Text)
+    created = Column(Float, index=True)
+    last_accessed = Column(Float, index=True)
+
+
+class MemoryCache:
+    """Bounded in-memory cache tier, safe to share between threads."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        policy: EvictionPolicy = EvictionPolicy.LRU,
+        ttl: Optional[float] = None,
+    ):
+        self.max_entries = max_entries
+        self.policy = policy
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, created = entry
+            if self.ttl is not None and time.time() - created > self.ttl:
+                del self._entries[key]
+                return None
+
+            if self.policy == EvictionPolicy.LRU:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            if self.policy == EvictionPolicy.LRU:
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SqliteCache:
+    """
+    Persistent cache tier, evicts by last access (LRU) or creation (FIFO).
+
+    Every call runs in its own short session, so the tier can be shared by
+    threads, and writes are upserts, so processes sharing the file do not
+    collide. Lookups do not write: LRU access times are collected and
+    stored with the next write. Entries are counted once, after that the
+    count is tracked and the table is only trimmed back to max_entries
+    once it has grown past it by evict_slack.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_entries: Optional[int] = 100_000,
+        policy: EvictionPolicy = EvictionPolicy.LRU,
+        ttl: Optional[float] = None,
+        evict_slack: float = 0.1,
+    ):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.policy = policy
+        self.ttl = ttl
+        self.evict_slack = evict_slack
+
+        if not os.path.exists(os.path.dirname(self.db_path)):
+            os.makedirs(os.path.dirname(self.db_path))
+
+        self.engine = create_engine(
+            f"sqlite:///{self.db_path}",
+            connect_args={"check_same_thread": False, "timeout": 30},
+        )
+        self.Session = sessionmaker(bind=self.engine)
+
+        CacheBase.metadata.create_all(self.engine)
+
+        self._lock = threading.Lock()
+        # Access times of LRU hits, written with the next write
+        self._accessed = {}
+        # Upper bound of the number of entries, overwrites count as new
+        self._entries = None
+
+    def get(self, key: str) -> Optional[str]:
+        return self.get_many([key]).get(key)
+
+    def set(self, key: str, value: str):
+        self.set_many({key: value})
+
+    def get_many(self, keys: list) -> dict:
+        """Looks up many keys with one query, returns the ones found."""
+        if not keys:
+            return {}
+
+        now = time.time()
+        found = {}
+        expired = []
+        try:
+            with self.Session() as session:
+                for entry in session.query(CachedResponseDB).filter(
+                    CachedResponseDB.key.in_(set(keys))
+                ):
+                    if self.ttl is not None and now - entry.created > self.ttl:
+                        expired.append(entry.key)
+                    else:
+                        found[entry.key] = entry.value
+        except SQLAlchemyError as e:
+            _logger.warning(f"Cache lookup in {self.db_path} failed: {e}")
+            return {}
+
+        if self.policy == EvictionPolicy.LRU and found:
+            with self._lock:
+                self._accessed.update(dict.fromkeys(found, now))
+        if expired:
+            self._write(
+                lambda session: session.query(CachedResponseDB)
+                .filter(CachedResponseDB.key.in_(expired))
+                .delete(synchronize_session=False)
+            )
+        return found
+
+    def set_many(self, items: dict):
+        """Stores many values in one transaction."""
+        if not items:
+            return
+
+        now = time.time()
+        rows = [
+            {"key": key, "value": value, "created": now, "last_accessed": now}
+            for key, value in items.items()
+        ]
+        statement = sqlite_insert(CachedResponseDB)
+        statement = statement.on_conflict_do_update(
+            index_elements=[CachedResponseDB.key],
+            set_={
+                "value": statement.excluded.value,
+                "created": statement.excluded.created,
+                "last_accessed": statement.excluded.last_accessed,
+            },
+        )
+        if self._write(lambda session: session.execute(statement, rows)):
+            self._evict(len(rows))
+
+    def _write(self, operation) -> bool:
+        """
+        Runs operation in a transaction together with the pending access
+        times. A failed write is rolled back and logged, the cache is an
+        optimization and must not fail the model call.
+        """
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+
+        try:
+            with self.Session.begin() as session:
+                if accessed:
+                    # Core executemany, rows evicted meanwhile are skipped
+                    session.execute(
+                        update(CachedResponseDB.__table__)
+                        .where(CachedResponseDB.key == bindparam("accessed_key"))
+                        .values(last_accessed=bindparam("accessed_at")),
+                        [
+                            {"accessed_key": key, "accessed_at": last_accessed}
+                            for key, last_accessed in accessed.items()
+                        ],
+                    )
+                operation(session)
+        except SQLAlchemyError as e:
+            _logger.warning(f"Cache write to {self.db_path} failed: {e}")
+            return False
+        return True
+
+    def _count(self) -> int:
+        with self.Session() as session:
+            return session.query(func.count(CachedResponseDB.key)).scalar()
+
+    def _evict(self, added: int):
+        if self.max_entries is None:
+            return
+
+        with self._lock:
+            if self._entries is not None:
+                self._entries += added
+                if self._entries <= self.max_entries * (1 + self.evict_slack):
+                    return
+
+        entries = self._count()
+        overflow = entries - self.max_entries
+        if overflow > 0:
+            order_column = (
+                CachedResponseDB.last_accessed
+                if self.policy == EvictionPolicy.LRU
+                else CachedResponseDB.created
+            )
+            stale_keys = (
+                select(CachedResponseDB.key)
+                .order_by(order_column.asc())
+                .limit(overflow)
+                .scalar_subquery()
+            )
+            if self._write(
+                lambda session: session.query(CachedResponseDB)
+                .filter(CachedResponseDB.key.in_(stale_keys))
+                .delete(synchronize_session=False)
+            ):
+                entries = self.max_entries
+
+        with self._lock:
+            self._entries = entries
+
+    def clear(self):
+        with self._lock:
+            self._accessed = {}
+        self._write(lambda session: session.query(CachedResponseDB).delete())
+        with self._lock:
+            self._entries = None
+
+
+class ResponseCache:
+    """
+    Caches LLM responses by a hash of everything that determines them:
+    model, system prompt, prompt, temperature and response model schema.
+    Lookups go to the memory tier first, then to the optional SQLite tier.
+    """
+
+    def __init__(
+        self,
+        memory_cache: Optional[MemoryCache] = None,
+        disk_cache: Optional[SqliteCache] = None,
+        deterministic_only: bool = True,
+    ):
+        self.memory_cache = memory_cache if memory_cache is not None else MemoryCache()
+        self.disk_cache = disk_cache
+        # Sampled (temperature > 0) responses are not reproducible, skip them
+        self.deterministic_only = deterministic_only
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(
+        model_id, system_prompt: str, prompt: str, temperature: float, response_model
+    ) -> str:
+        schema = (
+            response_model.model_json_schema() if response_model is not None else None
+        )
+        payload = json.dumps(
+            {
+                "model_id": model_id.value if isinstance(model_id, Enum) else model_id,
+                "system_prompt": system_prompt,
+                "prompt": prompt,
+                "temperature": temperature,
+                "response_model": schema,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def accepts(self, temperature: float) -> bool:
+        return not self.deterministic_only or temperature == 0
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory_cache.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+
+        if self.disk_cache is not None:
+            value = self.disk_cache.get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory_cache.set(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: str):
+        self.memory_cache.set(key, value)
+        if self.disk_cache is not None:
+            self.disk_cache.set(key, value)
+
+    def clear(self):
+        self.memory_cache.clear()
+        if self.disk_cache is not None:
+            self.disk_cache.clear()
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory_cache),
+        }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_response_cache() -> Optional[ResponseCache]:
+    """Returns the shared response cache, or None if caching is disabled."""
+    global _default_cache
+
+    if global_config.get("LLM_CACHE_ENABLED") != "true":
+        return None
+
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(
+                disk_cache=SqliteCache(
+                    os.path.join(os.getcwd(), "sqlite_db", "llm_cache.db")
+                ),
+                deterministic_only=global_config.get("LLM_CACHE_DETERMINISTIC_ONLY")
+                == "true",
+            )
+            _logger.debug("Initialized LLM response cache")
+    return _default_cache
@@ -7,13 +7,17 @@ Description: Defines the memory class, which is used to define the memory of an
 """
 
 from datetime import timedelta
+import threading
 import uuid
 
+import numpy as np
 from pydantic import BaseModel
 
-from simulatrex.db import SqliteDB, MemoryUnitDB
+from simulatrex.db import MemoryUnitDB, get_long_term_store
+from simulatrex.memory_store import get_memory_store
 from simulatrex.utils.log import SingletonLogger
-from simulatrex.vectordb import VectorDB
+from simulatrex.utils.sync import get_background_flusher, run_in_memory_executor
+from simulatrex.vectordb import create_vector_db
 
 _logger = SingletonLogger
 
@@ -23,7 +27,7 @@ class MemoryUnitModel(BaseModel):
     depth: float
     content: str
     keywords: str
-    id: str
+    id: str = ""
 
     score: float = 0.0
     created: int = 0
@@ -31,7 +35,9 @@ class MemoryUnitModel(BaseModel):
 
     def __init__(self, **data):
         super().__init__(**data)
-        self.id = str(uuid.uuid4())
+        # Keep the id of memories loaded from a store, they are written back
+        if not self.id:
+            self.id = str(uuid.uuid4())
 
     def get_metadata(self):
         return {
@@ -46,65 +52,204 @@ class MemoryUnitModel(BaseModel):
 
 
 class ShortTermMemory:
-    def __init__(self, id: str, decay_factor: int):
-        stm_id = "stm_" + id
-        self.vector_db = VectorDB(stm_id)
+    """
+    Buffers new memories and writes them to the vector db in bulk, once
+    flush_size memories are pending, before every retrieval, on flush() or
+    from the background flusher flush_interval seconds after the oldest
+    pending one was added.
+
+    Retrieval ranks candidates by a weighted sum of similarity to the
+    query, importance (the stored score) and recency decay since the last
+    access, and records the access in the store.
+
+    The a-prefixed methods are async counterparts that run on the memory
+    executor, calls of one memory are serialized by a lock.
+    """
+
+    def __init__(
+        self,
+        id: str,
+        decay_factor: int,
+        flush_size: int = 64,
+        flush_interval: float = 5.0,
+        vector_db_backend: str = None,
+        similarity_weight: float = 1.0,
+        importance_weight: float = 1.0,
+        recency_weight: float = 1.0,
+        candidate_factor: int = 3,
+        simulation_id: str = None,
+    ):
+        if simulation_id is not None:
+            # Partition of the collection shared by the whole simulation
+            self.vector_db = get_memory_store(
+                simulation_id, backend=vector_db_backend
+            ).for_agent(id)
+        else:
+            self.vector_db = create_vector_db("stm_" + id, backend=vector_db_backend)
         self.decay_factor = decay_factor
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.similarity_weight = similarity_weight
+        self.importance_weight = importance_weight
+        self.recency_weight = recency_weight
+        # Ranked by more than similarity, so fetch more than n_results
+        self.candidate_factor = candidate_factor
+
+        self._buffer = []
+        self._lock = threading.RLock()
 
     def add_memory(self, memory_unit: MemoryUnitModel):
-        _logger.debug(f"Adding STM memory with id {memory_unit.id}")
-        self.vector_db.add_memory(
-            memory_unit.content,
-            metadatas=[memory_unit.get_metadata()],
-            ids=[memory_unit.id],
-        )
+        self.add_memories([memory_unit])
+
+    def add_memories(self, memory_units: list):
+        if not memory_units:
+            return
+
+        _logger.debug(f"Buffering {len(memory_units)} STM memories")
+        with self._lock:
+            if not self._buffer:
+                # Written even if no further memory arrives
+                get_background_flusher().schedule(self.flush, self.flush_interval)
+            self._buffer.extend(memory_units)
+
+            if len(self._buffer) >= self.flush_size:
+                self.flush()
+
+    def flush(self):
+        """
+        Writes all buffered memories, e.g. at the end of an epoch. If the
+        write fails, e.g. on an embedding API error, the memories go back
+        to the buffer and are retried by the next flush.
+        """
+        with self._lock:
+            if not self._buffer:
+                return
+
+            memory_units, self._buffer = self._buffer, []
+            _logger.debug(f"Flushing {len(memory_units)} STM memories")
+            try:
+                self.vector_db.add_memories(
+                    [memory_unit.content for memory_unit in memory_units],
+                    metadatas=[
+                        memory_unit.get_metadata() for memory_unit in memory_units
+                    ],
+                    ids=[memory_unit.id for memory_unit in memory_units],
+                )
+            except Exception:
+                self._buffer[:0] = memory_units
+                get_background_flusher().schedule(self.flush, self.flush_interval)
+                raise
 
     def retrieve_memory(
         self, content: str, n_results: int, current_timestamp: int, time_multiplier: int
     ):
-        query_results = self.vector_db.query_memory(content, n_results=n_results)
-        metadata_entries = query_results["metadatas"][0]
-        results = []
+        with self._lock:
+            return self._retrieve_memory(
+                content, n_results, current_timestamp, time_multiplier
+            )
+
+    def _retrieve_memory(
+        self, content: str, n_results: int, current_timestamp: int, time_multiplier: int
+    ):
+        # Pending writes must be visible to the query
+        self.flush()
+        query_results = self.vector_db.query_memory(
+            content, n_results=n_results * self.candidate_factor
+        )
+        metadatas = query_results["metadatas"][0]
+        if not metadatas:
+            return []
+
+        # Squared L2 between unit vectors is 2 - 2 cos, back to [-1, 1]
+        similarity = 1.0 - np.asarray(query_results["distances"][0]) / 2.0
+        importance = np.array([m["score"] for m in metadatas], dtype=np.float64)
+        last_accessed = np.array(
+            [m["last_accessed"] for m in metadatas], dtype=np.float64
+        )
+        time_diff = (current_timestamp - last_accessed) / time_multiplier
+        recency = 1.0 / (1.0 + self.decay_factor * time_diff)
 
-        # Apply decay factor to the results based on the 'created' date
-        for i, metadata in enumerate(metadata_entries):
-            _logger.debug(f"Metadata: {metadata}")
-            time_diff = (
-                current_timestamp - metadata["last_accessed"]
-            ) / time_multiplier
-
-            decay = 1 / (1 + self.decay_factor * time_diff)
-            metadata["score"] *= decay
-            _logger.debug(f"Score: {metadata['score']}")
-
-            content = query_results["documents"][0][i]
-
-            memory = MemoryUnitModel(
-                id=metadata["id"],
-                type=metadata["type"],
-                depth=metadata["depth"],
-                content=content,
-                keywords=metadata["keywords"],
-                score=metadata["score"],
-                created=metadata["created"],
-                last_accessed=current_timestamp,
+        scores = (
+            self.similarity_weight * similarity
+            + self.importance_weight * importance
+            + self.recency_weight * recency
+        )
+        top = np.argsort(-scores)[:n_results]
+
+        results = []
+        for i in top:
+            metadata = metadatas[i]
+            results.append(
+                MemoryUnitModel(
+                    id=metadata["id"],
+                    type=metadata["type"],
+                    depth=metadata["depth"],
+                    content=query_results["documents"][0][i],
+                    keywords=metadata["keywords"],
+                    score=float(scores[i]),
+                    created=metadata["created"],
+                    last_accessed=current_timestamp,
+                )
             )
-            results.append(memory)
 
-        # Sort the results by score in descending order
-        results.sort(key=lambda x: x.score, reverse=True)
+        # Accessing a memory resets its recency decay
+        self.vector_db.update_metadatas(
+            [memory.id for memory in results],
+            [{"last_accessed": current_timestamp} for _ in results],
+        )
         return results
 
+    async def aadd_memory(self, memory_unit: MemoryUnitModel):
+        await run_in_memory_executor(self.add_memory, memory_unit)
+
+    async def aadd_memories(self, memory_units: list):
+        await run_in_memory_executor(self.add_memories, memory_units)
+
+    async def aflush(self):
+        await run_in_memory_executor(self.flush)
+
+    async def aretrieve_memory(
+        self, content: str, n_results: int, current_timestamp: int, time_multiplier: int
+    ):
+        return await run_in_memory_executor(
+            self.retrieve_memory,
+            content,
+            n_results,
+            current_timestamp,
+            time_multiplier,
+        )
+
 
 class LongTermMemory:
-    def __init__(self, id: str):
-        ltm_id = "ltm_" + id
-        self.db = SqliteDB(ltm_id)
+    def __init__(self, id: str, simulation_id: str = None):
+        # Partition of the store shared by all agents
+        self.db = get_long_term_store().for_agent(simulation_id or "", id)
 
     def add_memory(self, memory_unit: MemoryUnitModel):
         memory_unit_db = MemoryUnitDB(**memory_unit.model_dump())
         _logger.debug(f"Adding LTM memory with id {memory_unit_db.id}")
         self.db.insert_memory(memory_unit_db)
 
+    def add_memories(self, memory_units: list):
+        _logger.debug(f"Adding {len(memory_units)} LTM memories")
+        self.db.insert_memories(
+            [MemoryUnitDB(**memory_unit.model_dump()) for memory_unit in memory_units]
+        )
+
+    def flush(self):
+        self.db.flush()
+
+    async def aadd_memory(self, memory_unit: MemoryUnitModel):
+        await run_in_memory_executor(self.add_memory, memory_unit)
+
+    async def aadd_memories(self, memory_units: list):
+        await run_in_memory_executor(self.add_memories, memory_units)
+
+    async def aquery_memory_by_type(self, type: str, n_results: int = 5):
+        return await run_in_memory_executor(self.query_memory_by_type, type, n_results)
+
+    async def aflush(self):
+        await run_in_memory_executor(self.flush)
+
     def query_memory_by_type(self, type: str, n_results: int = 5):
         return self.db.query_memory_by_type(type, n_results)
@@ -0,0 +1,250 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: rate_limiter.py
+Description: Token bucket rate limiting for requests and tokens per minute
+
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from simulatrex.config import global_config
+from simulatrex.llms.types import LanguageModel
+from simulatrex.llms.utils.scheduler import Lane, current_lane
+from simulatrex.utils.log import SingletonLogger
+
+_logger = SingletonLogger
+
+# Rough chars per token ratio for English text, used before a response
+# tells us the real usage
+CHARS_PER_TOKEN = 4
+# Completion tokens reserved up front for every request
+DEFAULT_COMPLETION_TOKENS = 256
+
+# (requests per minute, tokens per minute), None means unlimited.
+# Conservative defaults for a low usage tier, overridden for every model by
+# LLM_RATE_LIMIT_RPM / LLM_RATE_LIMIT_TPM or per model by configure_rate_limit
+DEFAULT_RATE_LIMITS = {
+    LanguageModel.GPT_4_TURBO: (500, 30_000),
+    LanguageModel.GPT_4: (500, 10_000),
+    LanguageModel.GPT_3_5_Turbo: (3_500, 60_000),
+    LanguageModel.LLAMA_2_70B_CHAT_HF: (300, None),
+    LanguageModel.LLAMA_2_13B_CHAT_HF: (300, None),
+    LanguageModel.MISTRAL_7B_CHAT_HF: (300, None),
+    LanguageModel.MIXTRAL_8x7B_INSTRUCT: (300, None),
+}
+
+
+def count_tokens(*texts: str) -> int:
+    """Estimates the number of tokens in the given texts."""
+    return sum(len(text) for text in texts if text) // CHARS_PER_TOKEN
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Estimates the tokens of a request, including the completion reserve."""
+    return count_tokens(*texts) + DEFAULT_COMPLETION_TOKENS
+
+
+class TokenBucket:
+    """Bucket refilled continuously at capacity per minute."""
+
+    def __init__(self, per_minute: Optional[int]):
+        self.capacity = per_minute
+        self.level = float(per_minute) if per_minute is not None else 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.capacity is not None:
+            self.level = min(
+                self.capacity,
+                self.level + (now - self.updated) * self.capacity / 60.0,
+            )
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount can be taken from the bucket."""
+        if self.capacity is None:
+            return 0.0
+        self._refill()
+        # Requests larger than the bucket would never fit, cap them
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60.0 / self.capacity)
+
+    def take(self, amount: float):
+        if self.capacity is None:
+            return
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        """Adjusts the level after the fact, negative amounts charge extra."""
+        if self.capacity is None:
+            return
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """
+    Enforces a requests per minute and a tokens per minute budget. Callers
+    wait until both budgets allow their request instead of failing, so
+    throughput stays at the sustainable rate.
+
+    Budget is handed out one request at a time, by lane priority of the
+    scheduler and in arrival order within a lane: an interactive request
+    only waits for the refill of the request ahead of it, not for all the
+    simulation traffic queued before it. A request waiting longer than
+    max_wait seconds goes next regardless of its lane.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_wait: float = None,
+    ):
+        self.configure(requests_per_minute, tokens_per_minute)
+        self.max_wait = (
+            max_wait
+            if max_wait is not None
+            else float(global_config.get("LLM_SCHEDULER_MAX_WAIT_SEC"))
+        )
+
+        # Whether a request is currently waiting for the buckets to refill
+        self._busy = False
+        self._waiters = {lane: deque() for lane in Lane}
+
+        self.waited_seconds = 0.0
+
+    def configure(
+        self, requests_per_minute: Optional[int], tokens_per_minute: Optional[int]
+    ):
+        """Replaces the limits, waiting requests are paced by the new ones."""
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, estimated_tokens: int, request_lane: Lane = None):
+        await self._enter(request_lane or current_lane.get())
+        try:
+            while True:
+                wait = max(
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(estimated_tokens),
+                )
+                if wait <= 0:
+                    break
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+
+            self.requests.take(1)
+            self.tokens.take(estimated_tokens)
+        finally:
+            self._leave()
+
+    async def _enter(self, request_lane: Lane):
+        if not self._busy and not any(self._waiters.values()):
+            self._busy = True
+            return
+
+        queued = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[request_lane].append((queued, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted right before the cancel arrived, pass the turn on
+                self._leave()
+            else:
+                self._waiters[request_lane].remove((queued, future))
+            raise
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        waiting = [lane for lane in Lane if self._waiters[lane]]
+        if not waiting:
+            return None
+
+        oldest = min(waiting, key=lambda lane: self._waiters[lane][0][0])
+        if time.monotonic() - self._waiters[oldest][0][0] > self.max_wait:
+            return self._waiters[oldest].popleft()[1]
+        # Lanes are declared in priority order
+        return self._waiters[waiting[0]].popleft()[1]
+
+    def _leave(self):
+        while True:
+            future = self._next_waiter()
+            if future is None:
+                self._busy = False
+                return
+            if not future.done():
+                future.set_result(None)
+                return
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: int):
+        """Corrects the token budget once the actual usage is known."""
+        self.tokens.give_back(estimated_tokens - actual_tokens)
+
+    def stats(self) -> dict:
+        return {
+            "requests_per_minute": self.requests.capacity,
+            "tokens_per_minute": self.tokens.capacity,
+            "waited_seconds": self.waited_seconds,
+            "queued": {
+                lane.value: len(waiters) for lane, waiters in self._waiters.items()
+            },
+        }
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def _configured_limit(env_var: str, default: Optional[int]) -> Optional[int]:
+    value = global_config.get(env_var)
+    if value is None:
+        return default
+    # 0 lifts the limit
+    return int(value) or None
+
+
+def default_rate_limits(model_id: LanguageModel) -> tuple:
+    """Limits of a model id before configure_rate_limit is called."""
+    requests_per_minute, tokens_per_minute = DEFAULT_RATE_LIMITS.get(
+        model_id, (None, None)
+    )
+    return (
+        _configured_limit("LLM_RATE_LIMIT_RPM", requests_per_minute),
+        _configured_limit("LLM_RATE_LIMIT_TPM", tokens_per_minute),
+    )
+
+
+def get_rate_limiter(model_id: LanguageModel) -> RateLimiter:
+    """Returns the rate limiter shared by all models with this model id."""
+    limiter = _rate_limiters.get(model_id)
+    if limiter is None:
+        with _rate_limiters_lock:
+            limiter = _rate_limiters.get(model_id)
+            if limiter is None:
+                limiter = RateLimiter(*default_rate_limits(model_id))
+                _rate_limiters[model_id] = limiter
+    return limiter
+
+
+def configure_rate_limit(
+    model_id: LanguageModel,
+    requests_per_minute: Optional[int],
+    tokens_per_minute: Optional[int],
+):
+    """
+    Overrides the limits for a model id, e.g. to match the account tier.
+    Models created before keep their limiter, it is updated in place.
+    """
+    get_rate_limiter(model_id).configure(requests_per_minute, tokens_per_minute)
+    _logger.debug(
+        f"Rate limit for {model_id}: {requests_per_minute} RPM, {tokens_per_minute} TPM"
+    )
@@ -0,0 +1,185 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: retry.py
+Description: Retry policy and circuit breaker for LLM backends
+
+"""
+
+import asyncio
+import random
+import threading
+import time
+from enum import Enum
+from typing import Optional
+
+from simulatrex.config import global_config
+from simulatrex.utils.errors import (
+    LanguageModelAPIError,
+    LanguageModelRateLimitError,
+    LanguageModelUnavailableError,
+)
+from simulatrex.utils.log import SingletonLogger
+
+_logger = SingletonLogger
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Returns the delay requested by Retry-After style headers, in seconds."""
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after is not None:
+        try:
+            return float(retry_after)
+        except ValueError:
+            # HTTP dates are not worth the parsing, fall back to backoff
+            pass
+    return None
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive backend failures and then
+    rejects calls right away. After recovery_timeout seconds a single probe
+    call is let through, closing the circuit again if it succeeds.
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == CircuitState.CLOSED:
+            return True
+
+        now = time.monotonic()
+        if now - self.opened_at >= self.recovery_timeout:
+            # One probe per recovery window, a lost probe expires with it
+            self.state = CircuitState.HALF_OPEN
+            self.opened_at = now
+            return True
+
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.state != CircuitState.CLOSED:
+            _logger.info("Circuit breaker closed, backend recovered")
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if (
+            self.state == CircuitState.HALF_OPEN
+            or self.failures >= self.failure_threshold
+        ):
+            if self.state != CircuitState.OPEN:
+                _logger.warning(
+                    f"Circuit breaker opened after {self.failures} failures"
+                )
+            self.state = CircuitState.OPEN
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state.value,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter that honors Retry-After."""
+
+    def __init__(
+        self,
+        max_retries: int = None,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        jitter: bool = True,
+    ):
+        self.max_retries = (
+            max_retries
+            if max_retries is not None
+            else int(global_config.get("LLM_MAX_RETRIES"))
+        )
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        backoff = min(self.max_delay, self.base_delay * 2**attempt)
+        if self.jitter:
+            backoff = random.uniform(0, backoff)
+        if retry_after is not None:
+            # The server knows best, never retry earlier than asked to
+            backoff = max(backoff, min(retry_after, self.max_delay))
+        return backoff
+
+    async def run(self, call, circuit_breaker: Optional[CircuitBreaker] = None):
+        attempt = 0
+        while True:
+            if circuit_breaker is not None and not circuit_breaker.allow():
+                raise LanguageModelUnavailableError(
+                    "Backend unavailable, circuit breaker is open"
+                )
+
+            try:
+                result = await call()
+            except LanguageModelAPIError as e:
+                if circuit_breaker is not None:
+                    # Rate limits and bad requests mean the backend is up
+                    if e.retryable and not isinstance(e, LanguageModelRateLimitError):
+                        circuit_breaker.record_failure()
+                    else:
+                        circuit_breaker.record_success()
+
+                if not e.retryable or attempt >= self.max_retries:
+                    raise
+
+                delay = self.delay(attempt, e.retry_after)
+                attempt += 1
+                _logger.debug(
+                    f"Retrying LLM call in {delay:.2f}s ({attempt}/{self.max_retries}): {e}"
+                )
+                await asyncio.sleep(delay)
+            else:
+                if circuit_breaker is not None:
+                    circuit_breaker.record_success()
+                return result
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(model_id) -> CircuitBreaker:
+    """Returns the circuit breaker shared by all models with this model id."""
+    breaker = _circuit_breakers.get(model_id)
+    if breaker is None:
+        with _circuit_breakers_lock:
+            breaker = _circuit_breakers.get(model_id)
+            if breaker is None:
+                breaker = CircuitBreaker()
+                _circuit_breakers[model_id] = breaker
+    return breaker
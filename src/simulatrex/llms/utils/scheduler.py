@@ -0,0 +1,177 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: scheduler.py
+Description: Priority lanes with weighted fair queuing for LLM requests
+
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from enum import Enum
+from typing import Dict, Optional
+
+from simulatrex.config import global_config
+from simulatrex.utils.log import SingletonLogger
+
+_logger = SingletonLogger
+
+
+class Lane(Enum):
+    INTERACTIVE = "interactive"
+    SIMULATION = "simulation"
+    BACKGROUND = "background"
+
+
+# Share of the slots each lane gets while all of them have work queued
+DEFAULT_LANE_WEIGHTS = {
+    Lane.INTERACTIVE: 8,
+    Lane.SIMULATION: 4,
+    Lane.BACKGROUND: 1,
+}
+
+# Requests without an explicit lane are simulation traffic
+current_lane: ContextVar[Lane] = ContextVar("current_lane", default=Lane.SIMULATION)
+
+
+@contextmanager
+def lane(value: Lane):
+    """Sends all model calls made inside the block through the given lane."""
+    token = current_lane.set(value)
+    try:
+        yield
+    finally:
+        current_lane.reset(token)
+
+
+class RequestScheduler:
+    """
+    Caps the number of LLM requests in flight and hands free slots to the
+    lanes by weighted fair queuing: every lane has a virtual clock that
+    advances by 1 / weight per granted request and the lane with the
+    earliest clock goes next. A request queued for longer than max_wait
+    seconds is served next regardless of its lane, so no lane starves.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = None,
+        weights: Optional[Dict[Lane, float]] = None,
+        max_wait: float = None,
+    ):
+        self.max_concurrency = (
+            max_concurrency
+            if max_concurrency is not None
+            else int(global_config.get("LLM_MAX_CONCURRENT_REQUESTS"))
+        )
+        self.weights = {**DEFAULT_LANE_WEIGHTS, **(weights or {})}
+        self.max_wait = (
+            max_wait
+            if max_wait is not None
+            else float(global_config.get("LLM_SCHEDULER_MAX_WAIT_SEC"))
+        )
+
+        self.running = 0
+        self._queues = {lane: deque() for lane in Lane}
+        self._virtual_time = {lane: 0.0 for lane in Lane}
+
+        self.granted = {lane.value: 0 for lane in Lane}
+        self.waited = {lane.value: 0.0 for lane in Lane}
+        self.starvation_grants = 0
+
+    @asynccontextmanager
+    async def slot(self, request_lane: Optional[Lane] = None):
+        await self.acquire(request_lane)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, request_lane: Optional[Lane] = None):
+        request_lane = request_lane or current_lane.get()
+        queued = time.monotonic()
+
+        if self.running < self.max_concurrency and not any(self._queues.values()):
+            self._grant(request_lane, queued)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues[request_lane].append((queued, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted right before the cancel arrived, pass the slot on
+                self.release()
+            else:
+                self._queues[request_lane].remove((queued, future))
+            raise
+
+    def release(self):
+        self.running -= 1
+        self._dispatch()
+
+    def _grant(self, request_lane: Lane, queued: float):
+        self.running += 1
+        # Idle lanes must not bank credit, catch their clock up first
+        busy = [self._virtual_time[l] for l in Lane if self._queues[l]]
+        floor = min(busy) if busy else max(self._virtual_time.values())
+        self._virtual_time[request_lane] = (
+            max(self._virtual_time[request_lane], floor)
+            + 1.0 / self.weights[request_lane]
+        )
+        self.granted[request_lane.value] += 1
+        self.waited[request_lane.value] += time.monotonic() - queued
+
+    def _next_lane(self) -> Optional[Lane]:
+        waiting = [l for l in Lane if self._queues[l]]
+        if not waiting:
+            return None
+
+        now = time.monotonic()
+        oldest = min(waiting, key=lambda l: self._queues[l][0][0])
+        if now - self._queues[oldest][0][0] > self.max_wait:
+            self.starvation_grants += 1
+            return oldest
+
+        return min(
+            waiting,
+            key=lambda l: self._virtual_time[l] + 1.0 / self.weights[l],
+        )
+
+    def _dispatch(self):
+        while self.running < self.max_concurrency:
+            next_lane = self._next_lane()
+            if next_lane is None:
+                return
+            queued, future = self._queues[next_lane].popleft()
+            if future.done():
+                continue
+            self._grant(next_lane, queued)
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": {lane.value: len(queue) for lane, queue in self._queues.items()},
+            "granted": dict(self.granted),
+            "avg_wait": {
+                lane: self.waited[lane] / count if count else 0.0
+                for lane, count in self.granted.items()
+            },
+            "starvation_grants": self.starvation_grants,
+        }
+
+
+_request_scheduler = None
+
+
+def get_request_scheduler() -> RequestScheduler:
+    """Returns the scheduler shared by all LLM backends."""
+    global _request_scheduler
+    if _request_scheduler is None:
+        _request_scheduler = RequestScheduler()
+    return _request_scheduler
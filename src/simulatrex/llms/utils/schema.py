@@ -0,0 +1,279 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: schema.py
+Description: Random values that satisfy a JSON schema, for offline backends
+
+"""
+
+import math
+import random
+import string
+import uuid
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+from simulatrex.utils.log import SingletonLogger
+
+_logger = SingletonLogger
+
+# Open ended repeats and lengths stay short
+MAX_EXTRA_REPEATS = 3
+
+CATEGORY_CHARS = {
+    sre_parse.CATEGORY_DIGIT: string.digits,
+    sre_parse.CATEGORY_WORD: string.ascii_letters + string.digits + "_",
+    sre_parse.CATEGORY_SPACE: " ",
+}
+PRINTABLE = string.ascii_letters + string.digits + " "
+
+FORMATS = {
+    "date-time": lambda rng: f"2024-01-{rng.randint(1, 28):02d}T12:00:00Z",
+    "date": lambda rng: f"2024-01-{rng.randint(1, 28):02d}",
+    "time": lambda rng: f"{rng.randint(0, 23):02d}:00:00",
+    "uuid": lambda rng: str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+    "email": lambda rng: f"agent_{rng.getrandbits(16):04x}@example.com",
+    "uri": lambda rng: f"https://example.com/{rng.getrandbits(16):04x}",
+}
+
+
+def sample_from_schema(
+    schema: dict, rng: random.Random, defs: dict = None, name: str = "value"
+):
+    """
+    Builds a value that satisfies a (pydantic generated) JSON schema,
+    honouring numeric ranges, string lengths, patterns and formats and
+    array sizes. Free strings are named after their property.
+    """
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return sample_from_schema(defs[schema["$ref"].split("/")[-1]], rng, defs, name)
+    if "const" in schema:
+        return schema["const"]
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    for key in ("anyOf", "oneOf"):
+        if key in schema:
+            options = [s for s in schema[key] if s.get("type") != "null"]
+            return sample_from_schema(options[0], rng, defs, name) if options else None
+    if "allOf" in schema:
+        merged = {k: v for k, v in schema.items() if k != "allOf"}
+        for part in schema["allOf"]:
+            merged.update(part)
+        return sample_from_schema(merged, rng, defs, name)
+
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        kinds = [k for k in kind if k != "null"]
+        kind = kinds[0] if kinds else "null"
+
+    if kind == "object":
+        return _sample_object(schema, rng, defs, name)
+    if kind == "array":
+        return _sample_array(schema, rng, defs, name)
+    if kind == "integer":
+        return _sample_integer(schema, rng)
+    if kind == "number":
+        return _sample_number(schema, rng)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    if kind == "null":
+        return None
+    return _sample_string(schema, rng, name)
+
+
+def _sample_object(schema: dict, rng: random.Random, defs: dict, name: str) -> dict:
+    properties = schema.get("properties")
+    if properties is not None:
+        return {
+            prop_name: sample_from_schema(prop, rng, defs, prop_name)
+            for prop_name, prop in properties.items()
+        }
+
+    # A mapping, e.g. Dict[str, int]
+    values = schema.get("additionalProperties")
+    if not isinstance(values, dict):
+        return {}
+    keys = schema.get("propertyNames", {"type": "string"})
+    count = _sample_size(schema, "minProperties", "maxProperties", rng)
+    mapping = {}
+    for _ in range(count * 4):
+        if len(mapping) >= count:
+            break
+        key = sample_from_schema(keys, rng, defs, f"{name}_key")
+        mapping[key] = sample_from_schema(values, rng, defs, name)
+    return mapping
+
+
+def _sample_array(schema: dict, rng: random.Random, defs: dict, name: str) -> list:
+    # Fixed length tuples
+    if "prefixItems" in schema:
+        return [
+            sample_from_schema(item, rng, defs, name) for item in schema["prefixItems"]
+        ]
+
+    items = schema.get("items", {})
+    count = _sample_size(schema, "minItems", "maxItems", rng)
+    if not schema.get("uniqueItems"):
+        return [sample_from_schema(items, rng, defs, name) for _ in range(count)]
+
+    values = []
+    for _ in range(count * 4):
+        if len(values) >= count:
+            break
+        value = sample_from_schema(items, rng, defs, name)
+        if value not in values:
+            values.append(value)
+    return values
+
+
+def _sample_size(schema: dict, low_key: str, high_key: str, rng: random.Random):
+    low = schema.get(low_key, 1)
+    high = schema.get(high_key, low + MAX_EXTRA_REPEATS - 1)
+    return rng.randint(low, max(low, high))
+
+
+def _sample_integer(schema: dict, rng: random.Random) -> int:
+    low, high = _bounds(schema)
+    if "exclusiveMinimum" in schema:
+        low = math.floor(low) + 1
+    if "exclusiveMaximum" in schema:
+        high = math.ceil(high) - 1
+    low, high = _default_range(low, high, 100)
+    low, high = math.ceil(low), math.floor(high)
+
+    step = schema.get("multipleOf")
+    if step:
+        first, last = math.ceil(low / step), math.floor(high / step)
+        return int(rng.randint(first, max(first, last)) * step)
+    return rng.randint(low, max(low, high))
+
+
+def _sample_number(schema: dict, rng: random.Random) -> float:
+    low, high = _default_range(*_bounds(schema), 1.0)
+
+    step = schema.get("multipleOf")
+    if step:
+        first, last = math.ceil(low / step), math.floor(high / step)
+        return rng.randint(first, max(first, last)) * step
+
+    value = round(rng.uniform(low, high), 4)
+    # Rounding and exclusive bounds must not push the value out of range
+    too_low = value < low or value == low and "exclusiveMinimum" in schema
+    too_high = value > high or value == high and "exclusiveMaximum" in schema
+    if too_low or too_high:
+        value = low + (high - low) / 2
+    return value
+
+
+def _bounds(schema: dict):
+    """Lower and upper bound of a number, None where open."""
+    low = schema.get("minimum")
+    if "exclusiveMinimum" in schema:
+        low = max(v for v in (low, schema["exclusiveMinimum"]) if v is not None)
+    high = schema.get("maximum")
+    if "exclusiveMaximum" in schema:
+        high = min(v for v in (high, schema["exclusiveMaximum"]) if v is not None)
+    return low, high
+
+
+def _default_range(low, high, width):
+    """Fills in the open ends of a range, [0, width] if both are open."""
+    if low is None and high is None:
+        return 0, width
+    if low is None:
+        return high - width, high
+    if high is None:
+        return low, low + width
+    return low, high
+
+
+def _sample_string(schema: dict, rng: random.Random, name: str) -> str:
+    low = schema.get("minLength", 0)
+    high = schema.get("maxLength")
+
+    if schema.get("format") in FORMATS:
+        return FORMATS[schema["format"]](rng)
+
+    pattern = schema.get("pattern")
+    if pattern is not None:
+        for _ in range(10):
+            try:
+                value = _sample_pattern(pattern, rng)
+            except (NotImplementedError, ValueError) as e:
+                _logger.debug(f"Cannot sample pattern {pattern}: {e}")
+                break
+            if len(value) >= low and (high is None or len(value) <= high):
+                return value
+
+    value = f"{name}_{rng.getrandbits(16):04x}"
+    if high is not None and len(value) > high:
+        value = value[len(value) - high :]
+    while len(value) < low:
+        value += rng.choice(string.ascii_lowercase)
+    return value
+
+
+def _sample_pattern(pattern: str, rng: random.Random) -> str:
+    """Builds a string that matches a regular expression."""
+    groups = {}
+    return _sample_tokens(sre_parse.parse(pattern), rng, groups)
+
+
+def _sample_tokens(tokens, rng: random.Random, groups: dict) -> str:
+    return "".join(_sample_token(op, av, rng, groups) for op, av in tokens)
+
+
+def _sample_token(op, av, rng: random.Random, groups: dict) -> str:
+    if op == sre_parse.LITERAL:
+        return chr(av)
+    if op == sre_parse.NOT_LITERAL:
+        return rng.choice([c for c in PRINTABLE if ord(c) != av])
+    if op == sre_parse.ANY:
+        return rng.choice(PRINTABLE)
+    if op == sre_parse.IN:
+        return _sample_class(av, rng)
+    if op == sre_parse.AT:
+        return ""
+    if op == sre_parse.BRANCH:
+        return _sample_tokens(rng.choice(av[1]), rng, groups)
+    if op == sre_parse.SUBPATTERN:
+        group, tokens = av[0], av[-1]
+        value = _sample_tokens(tokens, rng, groups)
+        if group is not None:
+            groups[group] = value
+        return value
+    if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+        low, high, tokens = av
+        if high == sre_parse.MAXREPEAT:
+            high = low + MAX_EXTRA_REPEATS
+        return "".join(
+            _sample_tokens(tokens, rng, groups) for _ in range(rng.randint(low, high))
+        )
+    if op == sre_parse.GROUPREF:
+        return groups.get(av, "")
+    raise NotImplementedError(f"Unsupported regex construct {op}")
+
+
+def _sample_class(items, rng: random.Random) -> str:
+    chars = []
+    negate = False
+    for op, av in items:
+        if op == sre_parse.NEGATE:
+            negate = True
+        elif op == sre_parse.LITERAL:
+            chars.append(chr(av))
+        elif op == sre_parse.RANGE:
+            chars.extend(chr(c) for c in range(av[0], av[1] + 1))
+        elif op == sre_parse.CATEGORY and av in CATEGORY_CHARS:
+            chars.extend(CATEGORY_CHARS[av])
+        else:
+            raise NotImplementedError(f"Unsupported character class {op} {av}")
+    if negate:
+        chars = [c for c in PRINTABLE if c not in chars]
+    if not chars:
+        raise ValueError("Empty character class")
+    return rng.choice(chars)
@@ -0,0 +1,59 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: single_flight.py
+Description: Coalesces identical in-flight LLM requests into a single call
+
+"""
+
+import asyncio
+import copy
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers asking for a key that
+    is already in flight await the running call instead of issuing another.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, call):
+        """
+        Returns (result, shared), shared is True if the result came from a
+        call started by another caller.
+        """
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            # Callers get their own copy, structured responses are mutable
+            return copy.deepcopy(await asyncio.shield(task)), True
+
+        self.calls += 1
+        task = asyncio.ensure_future(call())
+        self._in_flight[key] = task
+        task.add_done_callback(lambda done: self._forget(key, done))
+
+        # Shielded so one cancelled caller does not fail everybody waiting
+        return await asyncio.shield(task), False
+
+    def _forget(self, key: str, task: asyncio.Future):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved if every caller went away
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
+
+
+# Export singleton
+single_flight = SingleFlight()
@@ -0,0 +1,211 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: usage.py
+Description: Token usage and cost accounting with budgets
+
+"""
+
+import asyncio
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from pydantic import BaseModel
+
+from simulatrex.llms.types import LanguageModel
+from simulatrex.utils.errors import BudgetExceededError
+from simulatrex.utils.log import SingletonLogger
+
+_logger = SingletonLogger
+
+# USD per 1K (prompt, completion) tokens
+COST_PER_1K_TOKENS = {
+    LanguageModel.GPT_4_TURBO: (0.01, 0.03),
+    LanguageModel.GPT_4: (0.03, 0.06),
+    LanguageModel.GPT_3_5_Turbo: (0.0005, 0.0015),
+}
+
+# Set by Simulation.run (or track_usage) so model calls know where to report
+current_usage_tracker: ContextVar[Optional["UsageTracker"]] = ContextVar(
+    "current_usage_tracker", default=None
+)
+current_epoch: ContextVar[Optional[int]] = ContextVar("current_epoch", default=None)
+
+
+def estimate_cost(model_id, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = COST_PER_1K_TOKENS.get(model_id, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+class UsageRecord(BaseModel):
+    model: str
+    agent_id: Optional[str] = None
+    epoch: Optional[int] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: float = 0.0
+    cost: float = 0.0
+
+
+class UsageTotals:
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency = 0.0
+        self.cost = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, record: UsageRecord):
+        self.requests += 1
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.latency += record.latency
+        self.cost += record.cost
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "avg_latency": self.latency / self.requests if self.requests else 0.0,
+            "cost": round(self.cost, 6),
+        }
+
+
+class Budget:
+    """
+    Token and cost limits for a run. Past a soft limit every call is delayed
+    by throttle_delay seconds, past a hard limit calls are refused.
+    """
+
+    def __init__(
+        self,
+        soft_tokens: Optional[int] = None,
+        hard_tokens: Optional[int] = None,
+        soft_cost: Optional[float] = None,
+        hard_cost: Optional[float] = None,
+        throttle_delay: float = 1.0,
+    ):
+        self.soft_tokens = soft_tokens
+        self.hard_tokens = hard_tokens
+        self.soft_cost = soft_cost
+        self.hard_cost = hard_cost
+        self.throttle_delay = throttle_delay
+
+    @staticmethod
+    def _reached(totals: UsageTotals, tokens, cost) -> bool:
+        return (tokens is not None and totals.total_tokens >= tokens) or (
+            cost is not None and totals.cost >= cost
+        )
+
+    def soft_limit_reached(self, totals: UsageTotals) -> bool:
+        return self._reached(totals, self.soft_tokens, self.soft_cost)
+
+    def hard_limit_reached(self, totals: UsageTotals) -> bool:
+        return self._reached(totals, self.hard_tokens, self.hard_cost)
+
+    def to_dict(self) -> dict:
+        return {
+            "soft_tokens": self.soft_tokens,
+            "hard_tokens": self.hard_tokens,
+            "soft_cost": self.soft_cost,
+            "hard_cost": self.hard_cost,
+        }
+
+
+class UsageTracker:
+    """Aggregates model usage per agent, per epoch and in total."""
+
+    def __init__(self, budget: Optional[Budget] = None):
+        self.budget = budget
+        self.total = UsageTotals()
+        self.by_model = defaultdict(UsageTotals)
+        self.by_agent = defaultdict(UsageTotals)
+        self.by_epoch = defaultdict(UsageTotals)
+        self._throttle_warned = False
+
+    def record(self, record: UsageRecord):
+        self.total.add(record)
+        self.by_model[record.model].add(record)
+        if record.agent_id is not None:
+            self.by_agent[record.agent_id].add(record)
+        if record.epoch is not None:
+            self.by_epoch[record.epoch].add(record)
+
+    def hard_limit_reached(self) -> bool:
+        return self.budget is not None and self.budget.hard_limit_reached(self.total)
+
+    async def check_budget(self):
+        """Called before every model call, throttles or refuses it."""
+        if self.budget is None:
+            return
+
+        if self.budget.hard_limit_reached(self.total):
+            raise BudgetExceededError(
+                f"Hard budget exceeded: {self.total.total_tokens} tokens, "
+                f"${self.total.cost:.4f}"
+            )
+
+        if self.budget.soft_limit_reached(self.total):
+            if not self._throttle_warned:
+                _logger.warning("Soft budget exceeded, throttling model calls")
+                self._throttle_warned = True
+            await asyncio.sleep(self.budget.throttle_delay)
+
+    def to_dict(self) -> dict:
+        return {
+            "total": self.total.to_dict(),
+            "by_model": {k: v.to_dict() for k, v in self.by_model.items()},
+            "by_agent": {k: v.to_dict() for k, v in self.by_agent.items()},
+            "by_epoch": {k: v.to_dict() for k, v in self.by_epoch.items()},
+            "budget": self.budget.to_dict() if self.budget else None,
+        }
+
+
+async def check_budget():
+    tracker = current_usage_tracker.get()
+    if tracker is not None:
+        await tracker.check_budget()
+
+
+def record_usage(
+    model_id,
+    agent_id: Optional[str],
+    prompt_tokens: int,
+    completion_tokens: int,
+    latency: float,
+):
+    """Reports a model call to the usage tracker of the current run, if any."""
+    tracker = current_usage_tracker.get()
+    if tracker is None:
+        return
+
+    tracker.record(
+        UsageRecord(
+            model=getattr(model_id, "value", str(model_id)),
+            agent_id=agent_id,
+            epoch=current_epoch.get(),
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            latency=latency,
+            cost=estimate_cost(model_id, prompt_tokens, completion_tokens),
+        )
+    )
+
+
+@contextmanager
+def track_usage(tracker: Optional[UsageTracker] = None):
+    """Records the usage of all model calls made inside the block."""
+    tracker = tracker if tracker is not None else UsageTracker()
+    token = current_usage_tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        current_usage_tracker.reset(token)
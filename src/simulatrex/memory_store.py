@@ -0,0 +1,179 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: memory_store.py
+Description: Shared vector memory of a simulation, partitioned by agent
+
+"""
+
+import hashlib
+import threading
+
+from simulatrex.config import global_config
+from simulatrex.db import get_long_term_store
+from simulatrex.embeddings import Embedder, create_embedder
+from simulatrex.utils.log import SingletonLogger
+from simulatrex.vectordb import AsyncVectorDBMixin, VectorDB, get_chroma_client
+
+_logger = SingletonLogger
+
+
+def shard_collection_name(simulation_id: str, shard: int, shards: int) -> str:
+    if shards == 1:
+        return f"sim_{simulation_id}"
+    return f"sim_{simulation_id}_{shard}"
+
+
+def scope_where(agent_id: str, where: dict = None) -> dict:
+    """Restricts a metadata filter to the memories of one agent."""
+    if not where:
+        return {"agent_id": agent_id}
+    return {"$and": [{"agent_id": agent_id}, where]}
+
+
+class AgentVectorDB(AsyncVectorDBMixin):
+    """
+    One agent's view on a shared collection, with the VectorDB interface.
+    Writes are tagged with the agent id and every query is scoped to it.
+    """
+
+    def __init__(self, vector_db: VectorDB, agent_id: str):
+        self.vector_db = vector_db
+        self.agent_id = agent_id
+        self.embedder = vector_db.embedder
+
+    def add_memory(self, content: str, metadatas=None, ids=None):
+        self.add_memories([content], metadatas=metadatas, ids=ids)
+
+    def add_memories(self, contents: list, metadatas=None, ids=None):
+        metadatas = metadatas or [{} for _ in contents]
+        self.vector_db.add_memories(
+            contents,
+            metadatas=[{**m, "agent_id": self.agent_id} for m in metadatas],
+            ids=ids,
+        )
+
+    def query_memory(
+        self, query_text, n_results=5, where_metadata=None, where_document=None
+    ):
+        return self.vector_db.query_memory(
+            query_text,
+            n_results=n_results,
+            where_metadata=scope_where(self.agent_id, where_metadata),
+            where_document=where_document,
+        )
+
+    def update_metadatas(self, ids: list, metadatas: list):
+        self.vector_db.update_metadatas(ids, metadatas)
+
+    def delete_memory(self, memory_id: str):
+        self.vector_db.delete_memory(memory_id)
+
+    def drop(self):
+        """Deletes all memories of this agent."""
+        self.vector_db.collection.delete(where={"agent_id": self.agent_id})
+
+
+class SimulationMemoryStore:
+    """
+    Holds the short-term memories of all agents of a simulation. With the
+    chroma backend they share a few (shards) collections, agents are assigned by
+    hash of their id and told apart by an agent_id metadata field. The
+    in-process backend keeps a small index per agent instead, which is
+    cheaper than filtering one large matrix.
+    """
+
+    def __init__(
+        self,
+        simulation_id: str,
+        backend: str = None,
+        shards: int = None,
+        embedder: Embedder = None,
+        path: str = None,
+    ):
+        self.simulation_id = simulation_id
+        self.backend = backend or global_config.get("VECTOR_DB_BACKEND")
+        self.shards = (
+            shards if shards is not None else int(global_config.get("VECTOR_DB_SHARDS"))
+        )
+        self.embedder = embedder if embedder is not None else create_embedder()
+        self.path = path
+
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def _collection_name(self, shard: int) -> str:
+        return shard_collection_name(self.simulation_id, shard, self.shards)
+
+    def _shard(self, agent_id: str) -> int:
+        digest = hashlib.sha256(agent_id.encode("utf-8")).digest()
+        return int.from_bytes(digest[:4], "little") % self.shards
+
+    def for_agent(self, agent_id: str):
+        """Returns the vector db of one agent."""
+        if self.backend == "memory":
+            from simulatrex.numpy_vectordb import NumpyVectorDB
+
+            key = f"stm_{self.simulation_id}_{agent_id}"
+            with self._lock:
+                if key not in self._collections:
+                    self._collections[key] = NumpyVectorDB(key, embedder=self.embedder)
+            return self._collections[key]
+
+        name = self._collection_name(self._shard(agent_id))
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = VectorDB(
+                    name, embedder=self.embedder, path=self.path
+                )
+        return AgentVectorDB(self._collections[name], agent_id)
+
+    def drop(self):
+        """Deletes the memories of every agent of the simulation at once."""
+        with self._lock:
+            collections, self._collections = self._collections, {}
+
+        for name, vector_db in collections.items():
+            vector_db.delete_collection(name)
+        _logger.info(f"Dropped memories of simulation {self.simulation_id}")
+
+
+_memory_stores = {}
+_memory_stores_lock = threading.Lock()
+
+
+def get_memory_store(simulation_id: str, backend: str = None) -> SimulationMemoryStore:
+    """Returns the memory store shared by all agents of a simulation."""
+    with _memory_stores_lock:
+        store = _memory_stores.get(simulation_id)
+        if store is None:
+            store = SimulationMemoryStore(simulation_id, backend=backend)
+            _memory_stores[simulation_id] = store
+    return store
+
+
+def drop_simulation_memories(simulation_id: str, shards: int = None, path: str = None):
+    """Deletes all memories of a simulation in one bulk operation per store."""
+    with _memory_stores_lock:
+        store = _memory_stores.pop(simulation_id, None)
+
+    if store is not None:
+        store.drop()
+    elif global_config.get("VECTOR_DB_BACKEND") == "chroma":
+        # Not opened in this process, delete the persisted shards directly.
+        # Opening them would create missing ones and check the embedder.
+        shards = (
+            shards if shards is not None else int(global_config.get("VECTOR_DB_SHARDS"))
+        )
+        client = get_chroma_client(path)
+        existing = {
+            getattr(collection, "name", collection)
+            for collection in client.list_collections()
+        }
+        for shard in range(shards):
+            name = shard_collection_name(simulation_id, shard, shards)
+            if name in existing:
+                client.delete_collection(name)
+        _logger.info(f"Dropped memories of simulation {simulation_id}")
+
+    get_long_term_store().drop_simulation(simulation_id)
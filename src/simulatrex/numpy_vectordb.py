@@ -0,0 +1,333 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: numpy_vectordb.py
+Description: In-process vector index on a NumPy matrix, same interface as VectorDB
+
+"""
+
+import json
+import os
+import uuid
+from typing import Optional
+
+import numpy as np
+
+from simulatrex.config import global_config
+from simulatrex.embeddings import Embedder, create_embedder, embedding_function_for
+from simulatrex.utils.errors import EmbedderMismatchError
+from simulatrex.utils.log import SingletonLogger
+from simulatrex.vectordb import AsyncVectorDBMixin
+
+_logger = SingletonLogger
+
+_COMPARISONS = {
+    "$eq": lambda a, b: a == b,
+    "$ne": lambda a, b: a != b,
+    "$gt": lambda a, b: a is not None and a > b,
+    "$gte": lambda a, b: a is not None and a >= b,
+    "$lt": lambda a, b: a is not None and a < b,
+    "$lte": lambda a, b: a is not None and a <= b,
+    "$in": lambda a, b: a in b,
+    "$nin": lambda a, b: a not in b,
+}
+
+
+def matches_metadata(metadata: dict, where: Optional[dict]) -> bool:
+    """Evaluates a ChromaDB style where filter against one metadata dict."""
+    if not where:
+        return True
+
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_metadata(metadata, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_metadata(metadata, c) for c in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if not _COMPARISONS[operator](value, operand):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def matches_document(document: str, where_document: Optional[dict]) -> bool:
+    if not where_document:
+        return True
+
+    for key, condition in where_document.items():
+        if key == "$and":
+            if not all(matches_document(document, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_document(document, c) for c in condition):
+                return False
+        elif key == "$contains":
+            if condition not in document:
+                return False
+        elif key == "$not_contains":
+            if condition in document:
+                return False
+    return True
+
+
+class NumpyVectorDB(AsyncVectorDBMixin):
+    """
+    Keeps a collection in process: unit length float32 vectors in one
+    contiguous matrix next to lists of ids, documents and metadata. A query
+    is a single matrix vector product plus an argpartition top-k, results
+    use the ChromaDB format and its default squared L2 distances. Made for
+    many small collections, e.g. one short-term memory per agent.
+    """
+
+    def __init__(
+        self,
+        collection_name: str,
+        embedder: Embedder = None,
+        snapshot_dir: str = None,
+        initial_capacity: int = 256,
+    ):
+        if collection_name is None:
+            raise Exception("No collection name provided.")
+
+        self.collection_name = collection_name
+        self.embedder = embedder if embedder is not None else create_embedder()
+        self.embedding_function = embedding_function_for(self.embedder)
+        self.snapshot_dir = snapshot_dir or global_config.get("VECTOR_DB_SNAPSHOT_DIR")
+
+        self._vectors = None
+        self._capacity = initial_capacity
+        self._size = 0
+        self._ids = []
+        self._documents = []
+        self._metadatas = []
+        self._rows = {}
+
+        if self.snapshot_dir and os.path.exists(self._snapshot_path("npy")):
+            self.load()
+
+    def __len__(self):
+        return self._size
+
+    def count(self) -> int:
+        return self._size
+
+    def _embed(self, texts: list) -> np.ndarray:
+        vectors = np.asarray(self.embedding_function(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+    def _reserve(self, rows: int, dimensions: int):
+        if self._vectors is None:
+            self._capacity = max(self._capacity, rows)
+            self._vectors = np.zeros((self._capacity, dimensions), dtype=np.float32)
+        elif self._size + rows > self._capacity:
+            while self._size + rows > self._capacity:
+                self._capacity *= 2
+            grown = np.zeros((self._capacity, dimensions), dtype=np.float32)
+            grown[: self._size] = self._vectors[: self._size]
+            self._vectors = grown
+
+    def add_memory(self, content: str, metadatas=None, ids=None):
+        """
+        Add memory which will be vectorized
+
+        Parameters:
+        - content: content string
+        - metadatas (list, optional): List of metadata dictionaries for each document. Defaults to None.
+        - ids (list, optional): List of unique IDs for each document. Defaults to None.
+        """
+        self.add_memories([content], metadatas=metadatas, ids=ids)
+
+    def add_memories(self, contents: list, metadatas=None, ids=None):
+        """
+        Add many memories at once, embedded in chunks of the embedder's
+        batch size. Existing ids are overwritten.
+
+        Parameters:
+        - contents (list): List of content strings
+        - metadatas (list, optional): List of metadata dictionaries for each document. Defaults to None.
+        - ids (list, optional): List of unique IDs for each document. Defaults to None.
+        """
+        if not contents:
+            return
+
+        metadatas = metadatas or [{} for _ in contents]
+        ids = ids or [str(uuid.uuid4()) for _ in contents]
+
+        batch_size = self.embedder.max_batch_size
+        for start in range(0, len(contents), batch_size):
+            end = start + batch_size
+            vectors = self._embed(contents[start:end])
+            self._reserve(len(vectors), vectors.shape[1])
+
+            for offset, vector in enumerate(vectors):
+                memory_id = ids[start + offset]
+                row = self._rows.get(memory_id)
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._rows[memory_id] = row
+                    self._ids.append(memory_id)
+                    self._documents.append(contents[start + offset])
+                    self._metadatas.append(dict(metadatas[start + offset] or {}))
+                else:
+                    self._documents[row] = contents[start + offset]
+                    self._metadatas[row] = dict(metadatas[start + offset] or {})
+                self._vectors[row] = vector
+
+    def query_memory(
+        self, query_text, n_results=5, where_metadata=None, where_document=None
+    ):
+        """
+        Query the index for semantically similar documents.
+
+        Parameters:
+        - query_text (str): The text to query against the stored documents.
+        - n_results (int, optional): Number of results to return. Defaults to 5.
+        - where_metadata (dict, optional): Filters based on metadata fields. Defaults to None.
+        - where_document (dict, optional): Filters based on document content. Defaults to None.
+
+        Returns:
+        - dict: Query results in the ChromaDB format.
+        """
+        results = {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+        if self._size == 0 or n_results <= 0:
+            return results
+
+        candidates = np.arange(self._size)
+        if where_metadata or where_document:
+            candidates = np.array(
+                [
+                    row
+                    for row in range(self._size)
+                    if matches_metadata(self._metadatas[row], where_metadata)
+                    and matches_document(self._documents[row], where_document)
+                ],
+                dtype=np.int64,
+            )
+            if candidates.size == 0:
+                return results
+
+        query = self._embed([query_text])[0]
+        similarities = self._vectors[candidates] @ query
+
+        k = min(n_results, candidates.size)
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+
+        for index in top:
+            row = int(candidates[index])
+            results["ids"][0].append(self._ids[row])
+            results["documents"][0].append(self._documents[row])
+            results["metadatas"][0].append(dict(self._metadatas[row]))
+            # Squared L2 of unit vectors, comparable to ChromaDB's default
+            results["distances"][0].append(float(2.0 - 2.0 * similarities[index]))
+        return results
+
+    def update_metadatas(self, ids: list, metadatas: list):
+        """
+        Merge metadata into existing memories
+
+        Parameters:
+        - ids (list): The ids of the memories to update
+        - metadatas (list): Metadata dictionaries with the fields to set
+        """
+        for memory_id, metadata in zip(ids, metadatas):
+            row = self._rows.get(memory_id)
+            if row is not None:
+                self._metadatas[row].update(metadata)
+
+    def delete_memory(self, memory_id: str):
+        """
+        Delete a memory by id
+
+        Parameters:
+        - id (str): The id of the memory to delete
+        """
+        row = self._rows.pop(memory_id, None)
+        if row is None:
+            return
+
+        # Move the last row into the gap to keep the matrix contiguous
+        last = self._size - 1
+        if row != last:
+            self._vectors[row] = self._vectors[last]
+            self._ids[row] = self._ids[last]
+            self._documents[row] = self._documents[last]
+            self._metadatas[row] = self._metadatas[last]
+            self._rows[self._ids[row]] = row
+
+        self._ids.pop()
+        self._documents.pop()
+        self._metadatas.pop()
+        self._size -= 1
+
+    def delete_collection(self, collection_id: str = None):
+        """Drops all memories and the snapshot, if any."""
+        self._vectors = None
+        self._size = 0
+        self._ids, self._documents, self._metadatas = [], [], []
+        self._rows = {}
+        if self.snapshot_dir:
+            for extension in ("npy", "json"):
+                if os.path.exists(self._snapshot_path(extension)):
+                    os.remove(self._snapshot_path(extension))
+
+    def _snapshot_path(self, extension: str) -> str:
+        return os.path.join(self.snapshot_dir, f"{self.collection_name}.{extension}")
+
+    def save(self, snapshot_dir: str = None):
+        """Writes the vectors to <collection>.npy, the rest to <collection>.json."""
+        self.snapshot_dir = snapshot_dir or self.snapshot_dir
+        if not self.snapshot_dir:
+            raise Exception("No snapshot directory configured.")
+        if not os.path.exists(self.snapshot_dir):
+            os.makedirs(self.snapshot_dir)
+
+        vectors = (
+            self._vectors[: self._size]
+            if self._vectors is not None
+            else np.zeros((0, 0), dtype=np.float32)
+        )
+        np.save(self._snapshot_path("npy"), vectors)
+        with open(self._snapshot_path("json"), "w") as f:
+            json.dump(
+                {
+                    "embedder": self.embedder.embedder_id,
+                    "ids": self._ids,
+                    "documents": self._documents,
+                    "metadatas": self._metadatas,
+                },
+                f,
+            )
+
+    def load(self, snapshot_dir: str = None):
+        self.snapshot_dir = snapshot_dir or self.snapshot_dir
+        with open(self._snapshot_path("json")) as f:
+            data = json.load(f)
+
+        if data["embedder"] != self.embedder.embedder_id:
+            raise EmbedderMismatchError(
+                f"Snapshot {self.collection_name} was built with embedder "
+                f"{data['embedder']}, not {self.embedder.embedder_id}."
+            )
+
+        vectors = np.load(self._snapshot_path("npy"))
+        self._size = len(data["ids"])
+        self._capacity = max(self._capacity, self._size)
+        self._vectors = None
+        if self._size:
+            self._vectors = np.zeros(
+                (self._capacity, vectors.shape[1]), dtype=np.float32
+            )
+            self._vectors[: self._size] = vectors
+        self._ids = data["ids"]
+        self._documents = data["documents"]
+        self._metadatas = data["metadatas"]
+        self._rows = {memory_id: row for row, memory_id in enumerate(self._ids)}
+        _logger.debug(f"Loaded {self._size} memories of {self.collection_name}")
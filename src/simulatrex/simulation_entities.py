@@ -1,6 +1,14 @@
+import asyncio
 import logging
-from simulatrex.llms.models.models import OpenAILanguageModel
+from pydantic import Field, create_model
+from simulatrex.llms.models.models import create_language_model
 from simulatrex.llms.types import LanguageModel
+from simulatrex.llms.utils.usage import (
+    UsageTracker,
+    current_epoch,
+    current_usage_tracker,
+)
+from simulatrex.utils.errors import BudgetExceededError
 
 
 class Agent:
@@ -11,24 +19,103 @@ class Agent:
         actions=None,
         llm_id=LanguageModel.GPT_4_TURBO,
         logger=logging.getLogger("simulation_logger"),
+        batch_actions=False,
     ):
         self.identifier = identifier
         self.attributes = attributes if attributes is not None else {}
         self.actions = actions if actions is not None else []
-        self.llm = OpenAILanguageModel(model_id=llm_id) if llm_id else None
+        self.llm = (
+            create_language_model(model_id=llm_id, agent_id=identifier)
+            if llm_id
+            else None
+        )
         self.logger = logger
+        # Generate all actions with one structured request instead of one per action
+        self.batch_actions = batch_actions
 
     async def act(self):
+        responses = {}
         if self.llm:
-            for action in self.actions:
-                response = await self.llm.ask(f"Generate an action for: {action}.")
-                self.logger.info(
-                    f"Agent {self.identifier} action for {action}: {response}"
-                )  # Use logger
+            if self.batch_actions and len(self.actions) > 1:
+                responses = await self._act_batched()
+            else:
+                for action in self.actions:
+                    responses[action] = await self._act_single(action)
         else:
             self.logger.warning(
                 f"Agent {self.identifier} has no LLM to generate action."
             )  # Use logger
+        return responses
+
+    async def _act_single(self, action):
+        response = await self.llm.ask(f"Generate an action for: {action}.")
+        self.logger.info(
+            f"Agent {self.identifier} action for {action}: {response}"
+        )  # Use logger
+        return response
+
+    async def stream_action(self, action):
+        """Yields the response for a single action chunk by chunk."""
+        if not self.llm:
+            self.logger.warning(
+                f"Agent {self.identifier} has no LLM to generate action."
+            )  # Use logger
+            return
+
+        chunks = []
+        async for chunk in self.llm.ask_stream(f"Generate an action for: {action}."):
+            chunks.append(chunk)
+            yield chunk
+        self.logger.info(
+            f"Agent {self.identifier} action for {action}: {''.join(chunks)}"
+        )  # Use logger
+
+    async def _act_batched(self):
+        """
+        Generates all actions in a single structured request. Actions missing
+        from a malformed response are generated one by one instead.
+        """
+        # Actions are keyed by position, DSL identifiers may clash with pydantic names
+        fields = {
+            f"action_{i}": (str, Field(description=f"Action for: {action}"))
+            for i, action in enumerate(self.actions)
+        }
+        response_model = create_model("AgentActions", **fields)
+        prompt = "Generate an action for each of the following, one per field:\n" + (
+            "\n".join(
+                f"- action_{i}: {action}" for i, action in enumerate(self.actions)
+            )
+        )
+
+        try:
+            structured_response = await self.llm.generate_structured_output(
+                prompt, response_model
+            )
+            batched = {
+                action: getattr(structured_response, f"action_{i}", None)
+                for i, action in enumerate(self.actions)
+            }
+        except BudgetExceededError:
+            # Per-action calls would be refused as well
+            raise
+        except Exception as e:
+            self.logger.warning(
+                f"Agent {self.identifier} batched actions failed, "
+                f"falling back to per-action calls: {e}"
+            )
+            batched = {}
+
+        responses = {}
+        for action in self.actions:
+            response = batched.get(action)
+            if isinstance(response, str) and response.strip():
+                self.logger.info(
+                    f"Agent {self.identifier} action for {action}: {response}"
+                )  # Use logger
+                responses[action] = response
+            else:
+                responses[action] = await self._act_single(action)
+        return responses
 
     def to_dict(self):
         return {
@@ -40,20 +127,76 @@ class Agent:
 
 class Environment:
     def __init__(
-        self, identifier, entities=None, logger=logging.getLogger("simulation_logger")
+        self,
+        identifier,
+        entities=None,
+        logger=logging.getLogger("simulation_logger"),
+        concurrent=False,
+        max_concurrency=16,
+        agent_timeout=None,
+        ordered=True,
     ):
         self.identifier = identifier
         self.entities = entities if entities is not None else []
         self.logger = logger  # Store logger
 
+        # Concurrent stepping: all agents act together, at most
+        # max_concurrency at a time, each bounded by agent_timeout seconds.
+        # With ordered=False results are returned in completion order.
+        self.concurrent = concurrent
+        self.max_concurrency = max_concurrency
+        self.agent_timeout = agent_timeout
+        self.ordered = ordered
+
     async def interact(self, agents):
+        """
+        Lets every agent act once and returns a list of
+        (agent identifier, responses) tuples.
+        """
         self.logger.info(  # Use logger
             f"Environment {self.identifier} is facilitating interaction among agents."
         )
-        for agent in agents:
-            await agent.act()
+        if self.concurrent:
+            results = await self._interact_concurrently(agents)
+        else:
+            results = [(agent.identifier, await agent.act()) for agent in agents]
         for entity in self.entities:
             self.logger.debug(f"Interacting with entity: {entity}")
+        return results
+
+    async def _interact_concurrently(self, agents):
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+
+        async def step(agent):
+            async with semaphore:
+                return agent.identifier, await self._step_agent(agent)
+
+        tasks = [asyncio.ensure_future(step(agent)) for agent in agents]
+        try:
+            if self.ordered:
+                return list(await asyncio.gather(*tasks))
+            return [await task for task in asyncio.as_completed(tasks)]
+        finally:
+            # Pending tasks remain if interact was cancelled or the budget
+            # ran out, stop them and collect their outcome
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _step_agent(self, agent):
+        """Runs a single agent step, isolating its timeout or failure."""
+        try:
+            return await asyncio.wait_for(agent.act(), timeout=self.agent_timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(
+                f"Agent {agent.identifier} timed out after {self.agent_timeout}s."
+            )
+        except BudgetExceededError:
+            # Ends the whole epoch, not just this agent's step
+            raise
+        except Exception as e:
+            self.logger.error(f"Agent {agent.identifier} failed to act: {e}")
+        return None
 
     def to_dict(self):
         return {
@@ -71,6 +214,7 @@ class Simulation:
         agents=None,
         environment=None,
         logger=None,
+        budget=None,
     ):
         self.identifier = identifier
         self.epochs = epochs
@@ -80,6 +224,8 @@ class Simulation:
         self.logger = (
             logger if logger is not None else logging.getLogger("simulation_logger")
         )
+        # Token usage and cost of all model calls made while running
+        self.usage = UsageTracker(budget)
 
     @property
     def agents(self):
@@ -99,11 +245,31 @@ class Simulation:
 
     async def run(self):
         self.logger.info(f"Simulation {self.identifier} started.")
-        for _ in range(self.epochs):
-            if self.environment:
-                await self.environment.interact(self.agents)
-            for interaction in self.interactions:
-                self.logger.info(f"Executing interaction: {interaction}")
+        usage_token = current_usage_tracker.set(self.usage)
+        try:
+            for epoch in range(self.epochs):
+                if self.usage.hard_limit_reached():
+                    self.logger.warning(
+                        f"Simulation {self.identifier} stopped at epoch {epoch}, "
+                        "budget exceeded."
+                    )
+                    break
+
+                epoch_token = current_epoch.set(epoch)
+                try:
+                    if self.environment:
+                        await self.environment.interact(self.agents)
+                    for interaction in self.interactions:
+                        self.logger.info(f"Executing interaction: {interaction}")
+                except BudgetExceededError as e:
+                    self.logger.warning(
+                        f"Simulation {self.identifier} stopped at epoch {epoch}: {e}"
+                    )
+                    break
+                finally:
+                    current_epoch.reset(epoch_token)
+        finally:
+            current_usage_tracker.reset(usage_token)
         self.logger.info(f"Simulation {self.identifier} ended.")
 
     def to_dict(self):
@@ -111,4 +277,5 @@ class Simulation:
             "id": self.identifier,
             "epochs": self.epochs,
             "interactions": self.interactions,
+            "usage": self.usage.to_dict(),
         }
@@ -29,6 +29,16 @@ class FailedTaskException(Exception):
         self.agent_response_dict = agent_response_dict
 
 
+class SimulationErrors(Exception):
+    pass
+
+
+class BudgetExceededError(SimulationErrors):
+    """Raised when a run has used up its hard token or cost budget."""
+
+    pass
+
+
 class DatabaseErrors(Exception):
     pass
 
@@ -37,6 +47,18 @@ class DatabaseConnectionError(DatabaseErrors):
     pass
 
 
+class EmbedderMismatchError(DatabaseErrors):
+    """Raised when a collection is opened with another embedder than it was built with."""
+
+    pass
+
+
+class DatabaseSchemaError(DatabaseErrors):
+    """Raised when a database file holds a table without the expected columns."""
+
+    pass
+
+
 class ConfigurationError(Exception):
     """Base exception for errors."""
 
@@ -63,6 +85,39 @@ class LanguageModelResponseNotJSONError(LanguageModelExceptions):
     pass
 
 
+class LanguageModelAPIError(LanguageModelExceptions):
+    """Raised when a call to a language model backend fails."""
+
+    def __init__(self, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class LanguageModelRateLimitError(LanguageModelAPIError):
+    """Raised when the backend rejects a call because of rate limits."""
+
+    pass
+
+
+class LanguageModelTimeoutError(LanguageModelAPIError):
+    """Raised when a call to the backend times out."""
+
+    pass
+
+
+class LanguageModelEmptyResponseError(LanguageModelAPIError):
+    """Raised when the backend returns no content."""
+
+    pass
+
+
+class LanguageModelUnavailableError(LanguageModelAPIError):
+    """Raised without calling the backend while its circuit breaker is open."""
+
+    pass
+
+
 class PromptError(Exception):
     pass
 
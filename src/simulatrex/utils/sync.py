@@ -2,16 +2,28 @@
 Author: Dominik Scherm (dom@simulatrex.ai)
 
 File: sync.py
-Description: Synchronous wrapper for asynchronous functions
+Description: Synchronous wrapper for asynchronous functions and an
+executor that runs blocking I/O off the event loop
 
 """
 
 import functools
 import asyncio
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import nest_asyncio
 
+from simulatrex.config import global_config
+from simulatrex.utils.log import SingletonLogger
+
 nest_asyncio.apply()
 
+_logger = SingletonLogger
+
 
 def sync_wrapper(async_func):
     """Decorator to create a synchronous wrapper for an asynchronous function."""
@@ -21,3 +33,94 @@ def sync_wrapper(async_func):
         return asyncio.run(async_func(*args, **kwargs))
 
     return wrapper
+
+
+_memory_executor = None
+_memory_executor_lock = threading.Lock()
+
+
+def get_memory_executor() -> ThreadPoolExecutor:
+    """Returns the pool of MEMORY_IO_WORKERS threads that memory I/O runs on."""
+    global _memory_executor
+
+    with _memory_executor_lock:
+        if _memory_executor is None:
+            _memory_executor = ThreadPoolExecutor(
+                max_workers=int(global_config.get("MEMORY_IO_WORKERS")),
+                thread_name_prefix="simulatrex-memory",
+            )
+    return _memory_executor
+
+
+async def run_in_memory_executor(func, *args, **kwargs):
+    """
+    Runs a blocking memory store call on the memory executor. The event
+    loop keeps serving other agents' LLM calls meanwhile, and the bounded
+    pool caps how many store calls run at once.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_memory_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+class BackgroundFlusher:
+    """
+    Runs flush callbacks once their deadline has passed, on one daemon
+    thread shared by all write buffers, so a buffer that goes idle is
+    still written. A callback already scheduled is not scheduled twice.
+    """
+
+    def __init__(self):
+        self._deadlines = []
+        self._pending = set()
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def schedule(self, flush, delay: float):
+        with self._condition:
+            if flush in self._pending:
+                return
+            self._pending.add(flush)
+            heapq.heappush(
+                self._deadlines, (time.monotonic() + delay, next(self._order), flush)
+            )
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="simulatrex-flusher", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._deadlines:
+                    self._condition.wait()
+                deadline, _, flush = self._deadlines[0]
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                heapq.heappop(self._deadlines)
+                self._pending.discard(flush)
+
+            try:
+                flush()
+            except Exception as e:
+                _logger.error(f"Background flush failed: {e}")
+
+
+_background_flusher = None
+_background_flusher_lock = threading.Lock()
+
+
+def get_background_flusher() -> BackgroundFlusher:
+    """Returns the flusher shared by all buffered memory stores."""
+    global _background_flusher
+
+    with _background_flusher_lock:
+        if _background_flusher is None:
+            _background_flusher = BackgroundFlusher()
+    return _background_flusher
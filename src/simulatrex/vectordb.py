@@ -7,50 +7,91 @@ Description: Defines the vectordb class, which is a wrapper around ChromaDB
 """
 import os
 import shutil
+import threading
+import uuid
 import chromadb
-from chromadb.utils import embedding_functions
 from dotenv import load_dotenv
 
 load_dotenv()
 
+from simulatrex.config import global_config
+from simulatrex.embeddings import Embedder, create_embedder, embedding_function_for
+from simulatrex.utils.errors import EmbedderMismatchError
 from simulatrex.utils.log import SingletonLogger
+from simulatrex.utils.sync import run_in_memory_executor
 
 _logger = SingletonLogger
 
+_chroma_clients = {}
+_chroma_clients_lock = threading.Lock()
 
-class VectorDB:
-    def __init__(self, collection_name: str):
-        api_key = os.getenv("OPENAI_API_KEY")
 
-        if api_key is None:
-            raise Exception(
-                "No OpenAI API key found. Please set OPENAI_API_KEY as environment variable."
-            )
+def vector_db_root() -> str:
+    """Storage root of persistent collections, VECTOR_DB_ROOT or ./chromadb."""
+    return global_config.get("VECTOR_DB_ROOT") or os.path.join(os.getcwd(), "chromadb")
+
+
+def get_chroma_client(path: str = None):
+    """Returns the ChromaDB client shared by all collections under path."""
+    path = path or vector_db_root()
+    with _chroma_clients_lock:
+        client = _chroma_clients.get(path)
+        if client is None:
+            client = chromadb.PersistentClient(path=path)
+            _chroma_clients[path] = client
+    return client
+
+
+class AsyncVectorDBMixin:
+    """Async counterparts of the vector db calls, run on the memory executor."""
 
+    async def aadd_memory(self, content: str, metadatas=None, ids=None):
+        await run_in_memory_executor(
+            self.add_memory, content, metadatas=metadatas, ids=ids
+        )
+
+    async def aadd_memories(self, contents: list, metadatas=None, ids=None):
+        await run_in_memory_executor(
+            self.add_memories, contents, metadatas=metadatas, ids=ids
+        )
+
+    async def aquery_memory(
+        self, query_text, n_results=5, where_metadata=None, where_document=None
+    ):
+        return await run_in_memory_executor(
+            self.query_memory,
+            query_text,
+            n_results=n_results,
+            where_metadata=where_metadata,
+            where_document=where_document,
+        )
+
+    async def aupdate_metadatas(self, ids: list, metadatas: list):
+        await run_in_memory_executor(self.update_metadatas, ids, metadatas)
+
+
+class VectorDB(AsyncVectorDBMixin):
+    def __init__(self, collection_name: str, embedder: Embedder = None, path=None):
         if collection_name is None:
             raise Exception("No collection name provided.")
 
         self.collection_name = collection_name
-        self.api_key = api_key
+        self.path = path
+        # Selected by EMBEDDING_BACKEND unless given
+        self.embedder = embedder if embedder is not None else create_embedder()
         self.init_chroma()
+        self._check_embedder()
 
     def init_chroma(self):
         try:
-            # Embed using openai, TODO: replace with abstract embedding
-            openai_embed_function = embedding_functions.OpenAIEmbeddingFunction(
-                api_key=self.api_key,
-                # TODO: replace with abstract model name
-                model_name="text-embedding-ada-002",
-            )
-
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            chroma_db_path = os.path.join(current_dir, "chromadb")
+            embedding_function = embedding_function_for(self.embedder)
 
-            self.client = chromadb.PersistentClient(path=chroma_db_path)
+            self.client = get_chroma_client(self.path)
 
             self.collection = self.client.create_collection(
                 name=self.collection_name,
-                embedding_function=openai_embed_function,
+                embedding_function=embedding_function,
+                metadata={"embedder": self.embedder.embedder_id},
                 get_or_create=True,
             )
 
@@ -58,6 +99,15 @@ class VectorDB:
             _logger.error(e)
             raise Exception("Failed to initialize ChromaDB collection.")
 
+    def _check_embedder(self):
+        """Refuses to mix vectors of different embedders in one collection."""
+        recorded = (self.collection.metadata or {}).get("embedder")
+        if recorded is not None and recorded != self.embedder.embedder_id:
+            raise EmbedderMismatchError(
+                f"Collection {self.collection_name} was built with embedder "
+                f"{recorded}, not {self.embedder.embedder_id}."
+            )
+
     def add_memory(self, content: str, metadatas=None, ids=None):
         """
         Add memory which will be vectorized
@@ -68,11 +118,32 @@ class VectorDB:
         - ids (list, optional): List of unique IDs for each document. Defaults to None.
         """
 
-        self.collection.add(
-            documents=[content],
-            metadatas=metadatas or [{}],  # Empty metadata if not provided
-            ids=ids,
-        )
+        self.add_memories([content], metadatas=metadatas, ids=ids)
+
+    def add_memories(self, contents: list, metadatas=None, ids=None):
+        """
+        Add many memories at once. Documents are embedded and written in
+        chunks of the largest batch both the embedding provider and
+        ChromaDB accept, instead of one request per memory.
+
+        Parameters:
+        - contents (list): List of content strings
+        - metadatas (list, optional): List of metadata dictionaries for each document. Defaults to None.
+        - ids (list, optional): List of unique IDs for each document. Defaults to None.
+        """
+        if not contents:
+            return
+
+        ids = ids or [str(uuid.uuid4()) for _ in contents]
+        batch_size = min(self.embedder.max_batch_size, self.client.get_max_batch_size())
+
+        for start in range(0, len(contents), batch_size):
+            end = start + batch_size
+            self.collection.add(
+                documents=contents[start:end],
+                metadatas=metadatas[start:end] if metadatas else None,
+                ids=ids[start:end],
+            )
 
     def query_memory(
         self, query_text, n_results=5, where_metadata=None, where_document=None
@@ -97,6 +168,17 @@ class VectorDB:
         )
         return results
 
+    def update_metadatas(self, ids: list, metadatas: list):
+        """
+        Merge metadata into existing memories with a single update
+
+        Parameters:
+        - ids (list): The ids of the memories to update
+        - metadatas (list): Metadata dictionaries with the fields to set
+        """
+        if ids:
+            self.collection.update(ids=ids, metadatas=metadatas)
+
     def delete_memory(self, memory_id: str):
         """
         Delete a memory by id
@@ -123,3 +205,16 @@ class VectorDB:
         - id (str): The id of the memory to delete
         """
         self.client.delete_collection(collection_id)
+
+
+def create_vector_db(collection_name: str, backend: str = None, embedder=None):
+    """
+    Returns the vector db for a collection, persistent ChromaDB ("chroma")
+    or the in-process NumPy index ("memory"). Defaults to VECTOR_DB_BACKEND.
+    """
+    backend = backend or global_config.get("VECTOR_DB_BACKEND")
+    if backend == "memory":
+        from simulatrex.numpy_vectordb import NumpyVectorDB
+
+        return NumpyVectorDB(collection_name, embedder=embedder)
+    return VectorDB(collection_name, embedder=embedder)
@@ -0,0 +1,149 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: test_llama_language_model.py
+Description: LlamaLanguageModel against a local stub of the HuggingFace inference API
+
+"""
+
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from pydantic import BaseModel
+
+from simulatrex.llms.models.models import LlamaLanguageModel, create_language_model
+from simulatrex.llms.types import LanguageModel
+from simulatrex.llms.utils.retry import RetryPolicy
+
+
+class Opinion(BaseModel):
+    stance: str
+    confidence: float
+
+
+class StubInferenceAPI:
+    """Answers text generation requests and records the client connections."""
+
+    def __init__(self):
+        self.requests = []
+        self.peers = set()
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.requests.append(payload)
+        self.peers.add(request.transport.get_extra_info("peername"))
+
+        if payload["stream"]:
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for text in ["Hello", ", ", "world"]:
+                event = {"token": {"text": text, "special": False}}
+                await response.write(f"data:{json.dumps(event)}\n\n".encode())
+            await response.write(
+                b'data:{"token": {"text": "</s>", "special": true}}\n\n'
+            )
+            await response.write_eof()
+            return response
+
+        if "JSON schema" in payload["inputs"]:
+            text = 'Sure: {"stance": "agree", "confidence": 0.8}'
+        else:
+            text = "Hello, world"
+        return web.json_response([{"generated_text": text}])
+
+
+@pytest.fixture
+def run_with_stub(monkeypatch):
+    monkeypatch.setenv("HUGGINGFACE_ACCESS_TOKEN", "test-token")
+
+    def run(scenario):
+        async def main():
+            stub = StubInferenceAPI()
+            app = web.Application()
+            app.router.add_post("/generate", stub.handle)
+            server = TestServer(app)
+            await server.start_server()
+            try:
+                model = LlamaLanguageModel(
+                    model_id=LanguageModel.LLAMA_2_13B_CHAT_HF,
+                    api_url=str(server.make_url("/generate")),
+                    retry_policy=RetryPolicy(max_retries=0),
+                )
+                return await scenario(model, stub)
+            finally:
+                await server.close()
+
+        return asyncio.run(main())
+
+    return run
+
+
+def test_ask_reuses_one_pooled_session(run_with_stub):
+    async def scenario(model, stub):
+        async with model:
+            answers = [await model.ask(f"Question {i}") for i in range(3)]
+            session = model._session
+            assert not session.closed
+        return answers, session
+
+    answers, session = run_with_stub(scenario)
+    assert answers == ["Hello, world"] * 3
+    assert session.closed
+
+
+def test_requests_share_a_keep_alive_connection(run_with_stub):
+    async def scenario(model, stub):
+        async with model:
+            for i in range(3):
+                await model.ask(f"Question {i}")
+        return stub
+
+    stub = run_with_stub(scenario)
+    assert len(stub.requests) == 3
+    assert len(stub.peers) == 1
+
+
+def test_generate_structured_output(run_with_stub):
+    async def scenario(model, stub):
+        async with model:
+            return await model.generate_structured_output("Agree?", Opinion), stub
+
+    opinion, stub = run_with_stub(scenario)
+    assert opinion == Opinion(stance="agree", confidence=0.8)
+    assert "JSON schema" in stub.requests[0]["inputs"]
+
+
+def test_ask_stream_yields_tokens(run_with_stub):
+    async def scenario(model, stub):
+        async with model:
+            return [chunk async for chunk in model.ask_stream("Greet me")]
+
+    assert run_with_stub(scenario) == ["Hello", ", ", "world"]
+
+
+def test_close_is_idempotent_and_session_reopens(run_with_stub):
+    async def scenario(model, stub):
+        await model.ask("First")
+        await model.close()
+        await model.close()
+        assert model._session is None
+
+        answer = await model.ask("Second")
+        await model.close()
+        return answer
+
+    assert run_with_stub(scenario) == "Hello, world"
+
+
+def test_mistral_models_are_served_by_the_inference_api(monkeypatch):
+    monkeypatch.setenv("HUGGINGFACE_ACCESS_TOKEN", "test-token")
+    for model_id in [
+        LanguageModel.MISTRAL_7B_CHAT_HF,
+        LanguageModel.MIXTRAL_8x7B_INSTRUCT,
+    ]:
+        model = create_language_model(model_id=model_id)
+        assert isinstance(model, LlamaLanguageModel)
+        assert model.api_url.startswith(LlamaLanguageModel.API_BASE_URL + "mistralai/")
@@ -0,0 +1,35 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: test_rate_limiter.py
+Description: Configuration of the shared per model rate limiters
+
+"""
+
+from simulatrex.config import global_config
+from simulatrex.llms.models.models import LlamaLanguageModel
+from simulatrex.llms.types import LanguageModel
+from simulatrex.llms.utils import rate_limiter
+from simulatrex.llms.utils.rate_limiter import configure_rate_limit, get_rate_limiter
+
+
+def test_configure_updates_the_limiter_models_already_hold(monkeypatch):
+    monkeypatch.setenv("HUGGINGFACE_ACCESS_TOKEN", "test-token")
+    monkeypatch.setattr(rate_limiter, "_rate_limiters", {})
+    model = LlamaLanguageModel(model_id=LanguageModel.LLAMA_2_13B_CHAT_HF)
+
+    configure_rate_limit(LanguageModel.LLAMA_2_13B_CHAT_HF, 10_000, 2_000_000)
+
+    assert model.rate_limiter is get_rate_limiter(LanguageModel.LLAMA_2_13B_CHAT_HF)
+    assert model.rate_limiter.stats()["requests_per_minute"] == 10_000
+    assert model.rate_limiter.stats()["tokens_per_minute"] == 2_000_000
+
+
+def test_config_overrides_the_default_limits(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_rate_limiters", {})
+    monkeypatch.setattr(global_config, "LLM_RATE_LIMIT_RPM", "0", raising=False)
+    monkeypatch.setattr(global_config, "LLM_RATE_LIMIT_TPM", "90000", raising=False)
+
+    stats = get_rate_limiter(LanguageModel.GPT_4).stats()
+    assert stats["requests_per_minute"] is None
+    assert stats["tokens_per_minute"] == 90_000
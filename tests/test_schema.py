@@ -0,0 +1,57 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: test_schema.py
+Description: Values sampled from the JSON schema of constrained response models
+
+"""
+
+import random
+from typing import Dict, List, Literal, Optional
+
+from pydantic import BaseModel, Field
+
+from simulatrex.llms.models.models import mock_instance
+from simulatrex.llms.utils.batch import local_response
+
+
+class Review(BaseModel):
+    code: str = Field(pattern=r"^[A-Z]{3}-\d{2,4}$")
+    confidence: float = Field(gt=0, lt=1)
+
+
+class Survey(BaseModel):
+    rating: float = Field(ge=1.0, le=5.0)
+    age: int = Field(ge=18)
+    score: int = Field(multiple_of=5, ge=7, le=40)
+    summary: str = Field(min_length=20, max_length=30)
+    initials: str = Field(max_length=3)
+    tags: List[str] = Field(min_length=2, max_length=4)
+    counts: Dict[str, int]
+    stance: Literal["agree", "disagree"]
+    reviews: List[Review]
+    follow_up: Optional[Review] = None
+
+
+def test_mock_instance_honours_field_constraints():
+    for seed in range(500):
+        assert isinstance(mock_instance(Survey, random.Random(seed)), Survey)
+
+
+def test_batch_tool_call_arguments_validate():
+    body = {
+        "model": "gpt-4",
+        "messages": [{"role": "user", "content": "How was it?"}],
+        "tools": [
+            {
+                "type": "function",
+                "function": {
+                    "name": "Survey",
+                    "parameters": Survey.model_json_schema(),
+                },
+            }
+        ],
+    }
+    message = local_response(body)["choices"][0]["message"]
+    arguments = message["tool_calls"][0]["function"]["arguments"]
+    assert isinstance(Survey.model_validate_json(arguments), Survey)
@@ -0,0 +1,47 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: test_short_term_memory.py
+Description: Write-behind buffer of ShortTermMemory
+
+"""
+
+import pytest
+
+from simulatrex.config import global_config
+from simulatrex.llms.utils.memory import MemoryUnitModel, ShortTermMemory
+
+
+class FlakyVectorDB:
+    """Fails the first write, like an embedding API returning a 5xx."""
+
+    def __init__(self):
+        self.failures = 1
+        self.ids = []
+
+    def add_memories(self, documents, metadatas, ids):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("embedding API unavailable")
+        self.ids.extend(ids)
+
+
+def test_failed_flush_keeps_the_memories_buffered(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(global_config, "EMBEDDING_BACKEND", "hashing")
+    memory = ShortTermMemory(
+        "agent", decay_factor=1, vector_db_backend="memory", flush_interval=60
+    )
+    memory.vector_db = FlakyVectorDB()
+    units = [
+        MemoryUnitModel(type="observation", depth=1.0, content=c, keywords="")
+        for c in ["a", "b", "c"]
+    ]
+
+    memory.add_memories(units[:2])
+    with pytest.raises(ConnectionError):
+        memory.flush()
+    memory.add_memory(units[2])
+    memory.flush()
+
+    assert memory.vector_db.ids == [unit.id for unit in units]
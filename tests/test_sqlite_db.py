@@ -0,0 +1,95 @@
+"""
+Author: Dominik Scherm (dom@simulatrex.ai)
+
+File: test_sqlite_db.py
+Description: Write-behind buffer of SqliteDB and the long-term memory shards
+
+"""
+
+import sqlite3
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from simulatrex.db import LongTermMemoryStore, MemoryUnitDB, SqliteDB
+from simulatrex.utils.errors import DatabaseSchemaError
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db = SqliteDB("memories", flush_interval=60)
+    yield db
+    db.close()
+
+
+def memory(id: str, content: str, created: int) -> MemoryUnitDB:
+    return MemoryUnitDB(id=id, type="observation", content=content, created=created)
+
+
+def stored(db: SqliteDB) -> dict:
+    return {m.id: m.content for m in db.query_memory_by_type("observation", 10)}
+
+
+def test_flush_replaces_memories_with_a_stored_id(db):
+    db.insert_memories([memory("x", "first", 1), memory("y", "y", 2)])
+    db.flush()
+    db.insert_memory(memory("x", "second", 3))
+    db.insert_memory(memory("z", "z", 4))
+    db.flush()
+
+    assert stored(db) == {"x": "second", "y": "y", "z": "z"}
+
+
+def test_failed_flush_keeps_the_batch_buffered(db, monkeypatch):
+    db.insert_memories([memory("x", "x", 1), memory("y", "y", 2)])
+
+    class FailingSession:
+        @staticmethod
+        def begin():
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    session = db.Session
+    monkeypatch.setattr(db, "Session", FailingSession)
+    with pytest.raises(OperationalError):
+        db.flush()
+    db.insert_memory(memory("z", "z", 3))
+    monkeypatch.setattr(db, "Session", session)
+
+    assert stored(db) == {"x": "x", "y": "y", "z": "z"}
+
+
+def create_legacy_db(path):
+    """Table of the former per agent databases, without the owner columns."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE memory_units (id VARCHAR PRIMARY KEY, type VARCHAR, "
+        "depth FLOAT, content VARCHAR, keywords VARCHAR, created INTEGER, "
+        "last_accessed INTEGER, score FLOAT)"
+    )
+    connection.commit()
+    connection.close()
+
+
+def test_long_term_shards_ignore_legacy_agent_databases(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    create_legacy_db(tmp_path / "sqlite_db" / "ltm_0.db")
+    create_legacy_db(tmp_path / "sqlite_db" / "ltm_1.db")
+    store = LongTermMemoryStore(shards=2)
+
+    for agent_id in ["0", "1", "2"]:
+        db = store.for_agent("simulation", agent_id)
+        db.insert_memory(memory(agent_id, agent_id, 1))
+        assert [m.content for m in db.query_memory_by_type("observation", 5)] == [
+            agent_id
+        ]
+    store.close()
+
+
+def test_opening_a_legacy_database_names_the_missing_columns(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    create_legacy_db(tmp_path / "sqlite_db" / "ltm_0.db")
+
+    with pytest.raises(DatabaseSchemaError, match="simulation_id"):
+        SqliteDB("ltm_0")